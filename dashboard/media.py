@@ -0,0 +1,166 @@
+"""
+Access-controlled media serving.
+
+Replaces the DEBUG-only ``static()`` route for MEDIA_URL. Dashboard users
+get media of customers they may open; a signed ``?token=`` (see
+whatsapp.media_store.signed_media_url) lets Meta fetch outbound attachments.
+
+Stored files never change in place (content-addressed blobs, uniquely
+named legacy files), so responses carry an ETag and an immutable
+Cache-Control and conditional requests get 304. Byte ranges are served for
+video/audio seeking. With MEDIA_SENDFILE set, the file is handed to the web
+server (nginx X-Accel-Redirect or Apache/lighttpd X-Sendfile) and this
+process never copies the bytes.
+"""
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+from whatsapp.media_store import blob_sha256, check_media_token
+from whatsapp.models import ArchivedMessage, Customer, Message
+
+from .views import check_access, is_admin_user
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def media_customer_ids(name):
+    """Customers whose messages, hot or archived, use this file (as media or thumbnail)"""
+    sha256 = blob_sha256(name)
+    customer_ids = set()
+    for model in (Message, ArchivedMessage):
+        if sha256:
+            # Content-addressed files resolve through the indexed blob link
+            matches = model.objects.filter(media_blob__sha256=sha256)
+        else:
+            # Legacy names (not yet moved by dedupe_media)
+            matches = model.objects.filter(Q(media=name) | Q(thumbnail=name))
+        customer_ids.update(matches.values_list('customer_id', flat=True).distinct())
+    return customer_ids
+
+
+def can_access_media(request, name):
+    token = request.GET.get('token')
+    if token:
+        return check_media_token(name, token)
+    if not check_access(request):
+        return False
+    customer_ids = media_customer_ids(name)
+    if not customer_ids:
+        return False
+    if is_admin_user(request):
+        return True
+    if request.session.get('is_agent'):
+        return Customer.objects.filter(
+            id__in=customer_ids, assigned_agent_id=request.session.get('agent_id')
+        ).exists()
+    return False
+
+
+def media_etag(name, stat):
+    sha256 = blob_sha256(name)
+    return quote_etag(sha256 or f"{stat.st_size:x}-{int(stat.st_mtime):x}")
+
+
+def parse_range(header, size):
+    """Return (start, end) inclusive for a single-range header, None to ignore it, or 'invalid'"""
+    match = RANGE_RE.match(header.strip())
+    if not match or size == 0:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return 'invalid'
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return 'invalid'
+    return start, end
+
+
+def read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def offload_response(name, path, content_type):
+    """Let the web server send the file; it also handles Range on its own"""
+    response = HttpResponse(content_type=content_type)
+    if getattr(settings, 'MEDIA_SENDFILE', None) == 'x-accel-redirect':
+        prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = f"{prefix.rstrip('/')}/{name}"
+    else:
+        response['X-Sendfile'] = path
+    return response
+
+
+@require_safe
+def serve_media(request, path):
+    name = os.path.normpath(path).replace(os.sep, '/')
+    if name.startswith('../') or name.startswith('/') or name == '..':
+        raise Http404("Media not found")
+    if not can_access_media(request, name):
+        return HttpResponse(status=403)
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, name)
+        stat = os.stat(full_path)
+    except (OSError, ValueError):
+        raise Http404("Media not found")
+
+    etag = media_etag(name, stat)
+    # Stored names keep their extension, so the type needs no lookup
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    max_age = getattr(settings, 'MEDIA_CACHE_MAX_AGE', 365 * 24 * 3600)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        # private: responses depend on who is asking
+        'Cache-Control': f"private, max-age={max_age}, immutable",
+        'Accept-Ranges': 'bytes',
+    }
+
+    if_none_match = request.headers.get('If-None-Match', '')
+    if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+        response = HttpResponse(status=304)
+    elif getattr(settings, 'MEDIA_SENDFILE', None):
+        response = offload_response(name, full_path, content_type)
+    else:
+        byte_range = None
+        range_header = request.headers.get('Range')
+        # If-Range: only honour the range while the client's copy is current
+        if range_header and request.headers.get('If-Range', etag) == etag:
+            byte_range = parse_range(range_header, stat.st_size)
+        if byte_range == 'invalid':
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{stat.st_size}"
+        elif byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                read_range(full_path, start, end - start + 1), status=206, content_type=content_type
+            )
+            response['Content-Range'] = f"bytes {start}-{end}/{stat.st_size}"
+            response['Content-Length'] = str(end - start + 1)
+        else:
+            response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    for header, value in headers.items():
+        response[header] = value
+    return response
@@ -0,0 +1,47 @@
+"""
+Home page stat cards.
+
+The numbers come from a customer count plus one conditional-aggregate query
+each over the hot and the archived messages, and are cached for
+DASHBOARD_STATS_TTL seconds per scope: one entry for admins, one per agent.
+The cards are allowed to lag by the TTL, which keeps the queries off the hot
+path of every home page load.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from whatsapp.models import ArchivedMessage, Customer, Message
+
+STATS_KEY = 'dashboard:stats:{}'
+
+
+def compute_stats(customers):
+    stats = {'total_customers': customers.count(), 'total_messages': 0, 'sent_messages': 0, 'received_messages': 0}
+    # Archived messages still count; one aggregate per table, as joining both would multiply rows
+    for model in (Message, ArchivedMessage):
+        counts = model.objects.filter(customer__in=customers).aggregate(
+            total_messages=Count('id'),
+            sent_messages=Count('id', filter=Q(direction='sent')),
+            received_messages=Count('id', filter=Q(direction='received')),
+        )
+        for name, value in counts.items():
+            stats[name] += value
+    return stats
+
+
+def get_dashboard_stats(is_admin, agent_id=None):
+    """Stat card values for an admin (everything) or one agent (assigned customers)"""
+    scope = 'all' if is_admin else f'agent:{agent_id}'
+    key = STATS_KEY.format(scope)
+    stats = cache.get(key)
+    if stats is None:
+        customers = Customer.objects.all() if is_admin else Customer.objects.filter(assigned_agent_id=agent_id)
+        stats = compute_stats(customers)
+        cache.set(key, stats, timeout=getattr(settings, 'DASHBOARD_STATS_TTL', 30))
+    return stats
+
+
+def invalidate_dashboard_stats(agent_ids=()):
+    """Drop the admin entry and those of the given agents (e.g. after reassigning chats)"""
+    cache.delete_many([STATS_KEY.format('all'), *(STATS_KEY.format(f'agent:{agent_id}') for agent_id in agent_ids)])
@@ -2,7 +2,7 @@ from django.urls import path
 from .views import (
     portal_view, agent_login_view, admin_login_view, logout_view,
     dashboard_home, chat_view, chat_messages_api, privacy_view, terms_view,
-    assign_chat
+    assign_chat, chat_stream, search_api
 )
 
 urlpatterns = [
@@ -13,7 +13,9 @@ urlpatterns = [
     path('home/', dashboard_home, name='dashboard-home'),
     path('chat/<int:customer_id>/', chat_view, name='dashboard-chat'),
     path('chat/<int:customer_id>/messages/', chat_messages_api, name='dashboard-chat-messages'),
+    path('chat/<int:customer_id>/stream/', chat_stream, name='dashboard-chat-stream'),
     path('chat/<int:customer_id>/assign/', assign_chat, name='assign-chat'),
+    path('search/', search_api, name='dashboard-search'),
     path('privacy/', privacy_view, name='privacy'),
     path('terms/', terms_view, name='terms'),
 ]
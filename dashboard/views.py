@@ -1,10 +1,32 @@
-from django.http import JsonResponse
+import asyncio
+import json
+import mimetypes
+import time
+from datetime import timedelta, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth import authenticate, login
+from django.db import transaction
+from django.db.models import Q
 from django.contrib import messages as django_messages
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from whatsapp.conversations import mark_read, record_message
+from whatsapp.db import replica_reads
+from whatsapp.events import acustomer_version, notify_customer
+from whatsapp.models import ArchivedMessage, Customer, Message, Agent
+from whatsapp.media_store import signed_media_url
+from whatsapp.outbox import enqueue_message
+from whatsapp.search import search_messages
+from whatsapp.thumbnails import apply_thumbnail, render_thumbnail
 
-from whatsapp.models import Customer, Message, Agent
-from whatsapp.whatsapp_api import send_whatsapp_message
+from .stats import get_dashboard_stats, invalidate_dashboard_stats
 
 
 def portal_view(request):
@@ -80,36 +102,39 @@ def terms_view(request):
 
 def get_customers_with_preview(request):
     """Get customers with last message preview and unread count, filtered by user type"""
-    from django.db.models import Count, Q, Max
-    
-    # Base queryset with annotations
-    customers = Customer.objects.annotate(
-        unread_count=Count('messages', filter=Q(messages__direction='received', messages__is_read=False)),
-        last_message_time=Max('messages__timestamp')
+    return list(sidebar_customers(visible_customers(request)))
+
+
+def sidebar_customers(customers):
+    """
+    Every customer in ``customers`` with the preview fields of its
+    conversation summary (see whatsapp.conversations), newest conversation
+    first; customers without messages yet come last, so a new assignment is
+    still listed.
+    """
+    from django.db.models import F, Value
+    from django.db.models.functions import Coalesce
+
+    customers = customers.annotate(
+        unread_count=Coalesce(F('conversation_summary__unread_count'), Value(0)),
+        last_message=Coalesce(F('conversation_summary__preview'), Value('')),
+        last_message_time=F('conversation_summary__last_message_at'),
     )
-    
+    return customers.order_by(F('last_message_time').desc(nulls_last=True), '-updated_at')
+
+
+def visible_customers(request, customers=None):
+    """Customers the caller may see: an agent's assigned chats, everything for admins"""
+    customers = Customer.objects.all() if customers is None else customers
     # Filter based on user type - check agent session FIRST
     if request.session.get('is_agent'):
         # Agent sees only assigned customers
-        agent_id = request.session.get('agent_id')
-        customers = customers.filter(assigned_agent_id=agent_id).order_by('-last_message_time', '-updated_at')
-    elif request.user.is_authenticated and request.user.is_superuser:
+        return customers.filter(assigned_agent_id=request.session.get('agent_id'))
+    if request.user.is_authenticated and request.user.is_superuser:
         # Admin sees all customers
-        customers = customers.order_by('-last_message_time', '-updated_at')
-    else:
-        # No access
-        customers = customers.none()
-    
-    # Add last message to each customer
-    customer_list = []
-    for c in customers:
-        last_msg = Message.objects.filter(customer=c).order_by('-timestamp').first()
-        c.last_message = last_msg.content[:30] + '...' if last_msg and len(last_msg.content) > 30 else (last_msg.content if last_msg else '')
-        c.last_message_time_display = last_msg.timestamp.strftime('%H:%M') if last_msg else ''
-        if last_msg and last_msg.media and not last_msg.content:
-            c.last_message = '📷 Photo' if 'image' in (last_msg.media_type or '') else '📎 File'
-        customer_list.append(c)
-    return customer_list
+        return customers
+    # No access
+    return customers.none()
 
 
 def check_access(request):
@@ -135,6 +160,7 @@ def is_admin_user(request):
     return request.user.is_authenticated and request.user.is_superuser
 
 
+@replica_reads
 def dashboard_home(request):
     if not check_access(request):
         return redirect('portal')
@@ -145,19 +171,8 @@ def dashboard_home(request):
     # Check if user is admin
     is_admin = is_admin_user(request)
     
-    # Stats based on user access
-    if is_admin:
-        total_customers = Customer.objects.count()
-        total_messages = Message.objects.count()
-        sent_messages = Message.objects.filter(direction='sent').count()
-        received_messages = Message.objects.filter(direction='received').count()
-    else:
-        agent_id = request.session.get('agent_id')
-        customer_ids = Customer.objects.filter(assigned_agent_id=agent_id).values_list('id', flat=True)
-        total_customers = len(customer_ids)
-        total_messages = Message.objects.filter(customer_id__in=customer_ids).count()
-        sent_messages = Message.objects.filter(customer_id__in=customer_ids, direction='sent').count()
-        received_messages = Message.objects.filter(customer_id__in=customer_ids, direction='received').count()
+    # Stats based on user access (one aggregate query, cached briefly per admin/agent scope)
+    stats = get_dashboard_stats(is_admin, request.session.get('agent_id'))
     
     # Get all agents for assignment dropdown (admin only)
     agents = Agent.objects.filter(is_active=True) if is_admin else []
@@ -166,10 +181,7 @@ def dashboard_home(request):
     agent_name = request.session.get('agent_name', '')
     
     context = {
-        'total_customers': total_customers,
-        'total_messages': total_messages,
-        'sent_messages': sent_messages,
-        'received_messages': received_messages,
+        **stats,
         'customers': customers,
         'agents': agents,
         'agent_name': agent_name,
@@ -194,78 +206,60 @@ def chat_view(request, customer_id):
     if request.method == 'POST':
         content = request.POST.get('content', '')
         media = request.FILES.get('media')
-        wa_id = None
-        from whatsapp.whatsapp_api import send_whatsapp_media
-        logger.info(f"Sending message to {customer.phone_number}: {content}")
-        # If media is uploaded, send it to WhatsApp
+        logger.info(f"Queueing message to {customer.phone_number}: {content}")
+        # The Graph API call happens in the send_outbound worker; here we only
+        # store the message and its queue entry
         if media:
             # Determine media type from file
             mime_type = media.content_type or mimetypes.guess_type(media.name)[0] or 'application/octet-stream'
             logger.info(f"Uploading media: {media.name}, type: {mime_type}")
-            
-            # Determine WhatsApp media type
-            if mime_type.startswith('image/'):
-                wa_media_type = 'image'
-            else:
-                wa_media_type = 'document'
-            
-            # Save the file first to get its URL
-            msg = Message.objects.create(
-                customer=customer,
-                content=content,
-                media=media,
-                media_type=mime_type,
-                direction='sent',
-                status='pending',
-            )
-            # Build public URL for media (update to your actual domain)
-            public_url = request.build_absolute_uri(msg.media.url)
-            logger.info(f"Sending {wa_media_type} via WhatsApp: {public_url}")
-            api_response = send_whatsapp_media(
-                customer.phone_number,
-                public_url,
-                media_type=wa_media_type,
-                caption=content if content else None
-            )
-            if isinstance(api_response, dict):
-                api_messages = api_response.get('messages')
-                if api_messages and isinstance(api_messages, list) and 'id' in api_messages[0]:
-                    wa_id = api_messages[0]['id']
-                elif 'messages' in api_response and isinstance(api_response['messages'], list):
-                    wa_id = api_response['messages'][0].get('id')
-                elif 'id' in api_response:
-                    wa_id = api_response['id']
-            msg.whatsapp_message_id = wa_id
-            msg.save()
+            with transaction.atomic():
+                # Save the file first to get its URL
+                msg = Message.objects.create(
+                    customer=customer,
+                    content=content,
+                    media=media,
+                    media_type=mime_type,
+                    direction='sent',
+                    status='pending',
+                )
+                enqueue_message(msg, {
+                    'type': 'media',
+                    # Meta fetches the file from this public URL when the worker sends it
+                    'media_url': request.build_absolute_uri(signed_media_url(msg.media.name)),
+                    'media_type': 'image' if mime_type.startswith('image/') else 'document',
+                    'caption': content or None,
+                    # Sent by uploaded media id, reused across sends of the same file
+                    'blob_id': msg.media_blob_id,
+                    'filename': media.name,
+                })
+                record_message(msg)
+            # Rendered after commit so the write lock is not held while Pillow works
+            preview = render_thumbnail(msg.media.name, mime_type)
+            if preview:
+                apply_thumbnail(msg, preview)
+                # updated_at puts the thumbnail into other viewers' next poll
+                msg.save(update_fields=[*preview, 'updated_at'])
+            notify_customer(customer.id)
+        elif content and content.strip():
+            with transaction.atomic():
+                msg = Message.objects.create(
+                    customer=customer,
+                    content=content,
+                    direction='sent',
+                    status='pending',
+                )
+                enqueue_message(msg, {'type': 'text', 'text': content})
+                record_message(msg)
+            notify_customer(customer.id)
         else:
-            # Send WhatsApp message (text only)
-            if content and content.strip():
-                api_response = send_whatsapp_message(customer.phone_number, template_name=None, text=content)
-                print(f"[DEBUG] API Response: {api_response}")
-            else:
-                print(f"[DEBUG] Content is empty, not sending!")
-                api_response = {}
-            if isinstance(api_response, dict):
-                api_messages = api_response.get('messages')
-                if api_messages and isinstance(api_messages, list) and 'id' in api_messages[0]:
-                    wa_id = api_messages[0]['id']
-                elif 'messages' in api_response and isinstance(api_response['messages'], list):
-                    wa_id = api_response['messages'][0].get('id')
-                elif 'id' in api_response:
-                    wa_id = api_response['id']
-            Message.objects.create(
-                customer=customer,
-                content=content,
-                direction='sent',
-                status='pending',
-                whatsapp_message_id=wa_id
-            )
+            logger.info("Content is empty, not sending")
         # Redirect to chat page to prevent duplicate sending on reload
         from django.urls import reverse
         return redirect(reverse('dashboard-chat', args=[customer.id]))
-    messages = Message.objects.filter(customer=customer).order_by('timestamp')
-    # Mark received messages as read
-    Message.objects.filter(customer=customer, direction='received', is_read=False).update(is_read=True)
+    # Mark received messages newer than the read watermark as read; the
+    # messages themselves are loaded by chat.html in windows
+    mark_read(customer.id)
     # Pass all customers for sidebar navigation with preview
     customers = get_customers_with_preview(request)
     # Check if user is admin
@@ -276,7 +270,6 @@ def chat_view(request, customer_id):
     agent_name = request.session.get('agent_name', '')
     return render(request, 'dashboard/chat.html', {
         'customer': customer,
-        'messages': messages,
         'customers': customers,
         'agents': agents,
         'agent_name': agent_name,
@@ -284,30 +277,264 @@ def chat_view(request, customer_id):
         'is_admin': is_admin,
     })
 
+def chat_window_size():
+    """Messages shown when a chat opens, and per "load older" page"""
+    return getattr(settings, 'CHAT_WINDOW_SIZE', 50)
+
+
+# Fields needed to render a chat bubble; keeps the polling query narrow
+MESSAGE_API_FIELDS = (
+    'id', 'content', 'direction', 'timestamp', 'status', 'media', 'media_type',
+    'thumbnail', 'placeholder', 'media_width', 'media_height',
+)
+
+# Messages and status changes written shortly before the previous poll's
+# server_time are sent again (the client skips message ids it has), so a write
+# that commits just after that poll is never missed. Ids alone are no cursor:
+# on PostgreSQL a row with a lower id can commit after one with a higher id.
+CURSOR_OVERLAP = timedelta(seconds=2)
+
+
+def serialize_message_row(row):
+    """Convert a Message.values() row into the JSON shape used by chat.html"""
+    media_name = row['media']
+    media_url = default_storage.url(media_name) if media_name else ''
+    # Use saved media_type if available, otherwise guess from extension
+    media_type = row['media_type'] or ''
+    if media_name and not media_type:
+        media_type = mimetypes.guess_type(media_url)[0] or ''
+    return {
+        'id': row['id'],
+        'content': row['content'],
+        'direction': row['direction'],
+        'timestamp': row['timestamp'].strftime('%b %d, %Y %H:%M'),
+        'status': row['status'].title(),
+        'media_url': media_url,
+        'media_type': media_type,
+        # Images render the thumbnail and link to media_url for the original
+        'thumb_url': default_storage.url(row['thumbnail']) if row['thumbnail'] else '',
+        'placeholder': row['placeholder'],
+        'width': row['media_width'],
+        'height': row['media_height'],
+    }
+
+
+def parse_cursor_time(value):
+    """Parse an ISO timestamp cursor, returning an aware datetime or None"""
+    parsed = parse_datetime(value) if value else None
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
+
+
+def get_message_deltas(customer_id, after='', since=''):
+    """
+    Build the chat payload for a customer.
+
+    Without ``after`` the most recent CHAT_WINDOW_SIZE messages are returned,
+    with ``has_older`` telling whether get_older_messages has more. With ``after=<message id>``
+    or ``after=<ISO timestamp>`` only messages newer than the cursor are returned,
+    plus ``updates`` (id, status, thumb_url) for older messages changed since
+    ``since`` - the ``server_time`` echoed by the previous payload. Messages created
+    within CURSOR_OVERLAP before ``since`` are returned again, whatever their id,
+    in case they committed after the previous poll. Returns None if the cursor cannot
+    be parsed.
+    """
+    server_time = timezone.now()
+    messages = Message.objects.filter(customer_id=customer_id)
+
+    after = (after or '').strip()
+    since = parse_cursor_time((since or '').strip())
+    updates = None
+    has_older = False
+    if not after:
+        new_messages, has_older = history_page(customer_id, chat_window_size())
+        cursor = None
+    elif after.isdigit():
+        cursor = int(after)
+        new_messages = messages.filter(id__gt=cursor)
+        if since:
+            # timestamp is set on insert, so this re-sends only newly written rows
+            new_messages = messages.filter(Q(id__gt=cursor) | Q(timestamp__gt=since - CURSOR_OVERLAP))
+            updates = messages.filter(id__lte=cursor, updated_at__gt=since - CURSOR_OVERLAP)
+    else:
+        after_time = parse_cursor_time(after)
+        if after_time is None:
+            return None
+        cursor = None
+        window_start = (since or after_time) - CURSOR_OVERLAP
+        new_messages = messages.filter(timestamp__gt=min(after_time, window_start))
+        updates = messages.filter(timestamp__lte=after_time, updated_at__gt=window_start)
+
+    if not isinstance(new_messages, list):
+        new_messages = new_messages.order_by('timestamp', 'id').values(*MESSAGE_API_FIELDS)
+    data = [serialize_message_row(row) for row in new_messages]
+    if data:
+        # Re-sent older rows must not move the cursor back
+        cursor = max([row['id'] for row in data] + ([cursor] if cursor is not None else []))
+    elif cursor is None:
+        cursor = messages.order_by('-id').values_list('id', flat=True).first()
+    updates = [
+        {
+            'id': row['id'],
+            'status': row['status'].title(),
+            'thumb_url': default_storage.url(row['thumbnail']) if row['thumbnail'] else '',
+        }
+        for row in updates.values('id', 'status', 'thumbnail')
+    ] if updates is not None else []
+    return {
+        'messages': data,
+        'updates': updates,
+        'cursor': cursor,
+        'server_time': server_time.isoformat(),
+        'incremental': bool(after),
+        'has_older': has_older,
+    }
+
+
+def history_page(customer_id, limit, condition=None):
+    """
+    The newest ``limit`` messages of a customer matching ``condition``, oldest
+    first, from the hot table and the archive, plus whether more exist.
+    Messages kept hot (unread, still queued) can be older than archived ones,
+    so both are read and merged.
+    """
+    rows = []
+    for model in (Message, ArchivedMessage):
+        messages = model.objects.filter(customer_id=customer_id)
+        if condition is not None:
+            messages = messages.filter(condition)
+        # Newest first to use the (customer, timestamp) index, then flipped for display
+        rows += messages.order_by('-timestamp', '-id').values(*MESSAGE_API_FIELDS)[:limit + 1]
+    rows.sort(key=lambda row: (row['timestamp'], row['id']), reverse=True)
+    return rows[:limit][::-1], len(rows) > limit
+
+
+def get_older_messages(customer_id, before, limit=None):
+    """
+    One "load older" page: up to ``limit`` messages preceding message ``before``
+    in (timestamp, id) order, oldest first. Reads through into the archive, where
+    old messages keep their ids. Returns None if ``before`` is not a message of
+    this customer.
+    """
+    anchor = None
+    for model in (Message, ArchivedMessage):
+        anchor = model.objects.filter(customer_id=customer_id, id=before).values('timestamp', 'id').first()
+        if anchor is not None:
+            break
+    if anchor is None:
+        return None
+    # Keyset condition: strictly before the anchor, ties on timestamp broken by id
+    older = Q(timestamp__lt=anchor['timestamp']) | Q(timestamp=anchor['timestamp'], id__lt=anchor['id'])
+    rows, has_older = history_page(customer_id, limit or chat_window_size(), older)
+    return {
+        'messages': [serialize_message_row(row) for row in rows],
+        'has_older': has_older,
+    }
+
+
 def chat_messages_api(request, customer_id):
+    """
+    Polling endpoint for chat.html; see get_message_deltas for the cursor protocol.
+    ``?before=<message id>`` returns the previous page instead (get_older_messages).
+    Deltas are read from the primary: replica lag could exceed CURSOR_OVERLAP
+    and a message would be skipped for good. Older pages may come from the replica.
+    """
+    if not check_access(request):
+        return JsonResponse({'error': 'Unauthorized'}, status=403)
     customer = get_object_or_404(Customer, id=customer_id)
-    messages = Message.objects.filter(customer=customer).order_by('timestamp')
-    data = []
-    for m in messages:
-        media_url = m.media.url if m.media else ''
-        # Use saved media_type if available, otherwise guess from extension
-        if m.media_type:
-            media_type = m.media_type
-        elif m.media:
-            import mimetypes
-            guessed_type, _ = mimetypes.guess_type(media_url)
-            media_type = guessed_type or ''
-        else:
-            media_type = ''
-        data.append({
-            'content': m.content,
-            'direction': m.direction,
-            'timestamp': m.timestamp.strftime('%b %d, %Y %H:%M'),
-            'status': m.status.title(),
-            'media_url': media_url,
-            'media_type': media_type,
-        })
-    return JsonResponse({'messages': data})
+    if not can_access_customer(request, customer):
+        return JsonResponse({'error': 'Unauthorized'}, status=403)
+    before = (request.GET.get('before') or '').strip()
+    if before:
+        payload = replica_reads(get_older_messages)(customer.id, int(before)) if before.isdigit() else None
+        if payload is None:
+            return JsonResponse({'error': 'Invalid cursor'}, status=400)
+        return JsonResponse(payload)
+    payload = get_message_deltas(customer.id, request.GET.get('after'), request.GET.get('since'))
+    if payload is None:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    return JsonResponse(payload)
+
+
+@replica_reads
+def search_api(request):
+    """
+    Full-text search over the messages of the caller's visible customers:
+    ``?q=<text>&limit=<n>``, best matches first with highlighted snippets
+    (see whatsapp.search).
+    """
+    if not check_access(request):
+        return JsonResponse({'error': 'Unauthorized'}, status=403)
+    query = (request.GET.get('q') or '').strip()
+    limit = request.GET.get('limit') or None
+    if limit is not None and (not limit.isdigit() or int(limit) < 1):
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+    if len(query) < 2:
+        return JsonResponse({'query': query, 'results': []})
+    return JsonResponse({'query': query, 'results': search_messages(query, visible_customers(request), limit)})
+
+
+def _stream_access(request, customer_id):
+    """Sync half of chat_stream: resolve the customer if the caller may see it"""
+    if not check_access(request):
+        return None
+    customer = Customer.objects.filter(id=customer_id).first()
+    if customer is None or not can_access_customer(request, customer):
+        return None
+    return customer
+
+
+async def chat_stream(request, customer_id):
+    """
+    Server-Sent Events stream of message deltas for one customer.
+
+    Only served under ASGI: a long-lived response would pin a sync gunicorn
+    worker, so under WSGI it answers 204 and chat.html keeps polling.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    customer = await sync_to_async(_stream_access)(request, customer_id)
+    if customer is None:
+        return HttpResponse(status=403)
+    payload = await sync_to_async(get_message_deltas)(
+        customer.id, request.GET.get('after'), request.GET.get('since')
+    )
+    if payload is None:
+        return HttpResponse(status=400)
+
+    poll_interval = getattr(settings, 'CHAT_STREAM_POLL_INTERVAL', 0.5)
+    keepalive = getattr(settings, 'CHAT_STREAM_KEEPALIVE', 15)
+    max_age = getattr(settings, 'CHAT_STREAM_MAX_AGE', 300)
+
+    async def events():
+        nonlocal payload
+        started = last_sent = time.monotonic()
+        version = await acustomer_version(customer.id)
+        yield 'retry: 3000\n\n'
+        while True:
+            if payload['messages'] or payload['updates']:
+                yield f"event: messages\ndata: {json.dumps(payload)}\n\n"
+                last_sent = time.monotonic()
+            after, since = str(payload['cursor'] or ''), payload['server_time']
+            while True:
+                now = time.monotonic()
+                if now - started > max_age:
+                    return
+                if now - last_sent > keepalive:
+                    yield ': keepalive\n\n'
+                    last_sent = now
+                await asyncio.sleep(poll_interval)
+                current = await acustomer_version(customer.id)
+                if current != version:
+                    version = current
+                    break
+            payload = await sync_to_async(get_message_deltas)(customer.id, after, since)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 def assign_chat(request, customer_id):
@@ -319,11 +546,13 @@ def assign_chat(request, customer_id):
         try:
             customer = get_object_or_404(Customer, id=customer_id)
             agent_id = request.POST.get('agent_id', '').strip()
+            previous_agent_id = customer.assigned_agent_id
             
             if agent_id:
                 agent = Agent.objects.get(id=int(agent_id), is_active=True)
                 customer.assigned_agent = agent
                 customer.save()
+                invalidate_dashboard_stats([previous_agent_id, agent.id])
                 return JsonResponse({
                     'success': True,
                     'message': f'Chat assigned to {agent.name}',
@@ -333,6 +562,7 @@ def assign_chat(request, customer_id):
                 # Unassign
                 customer.assigned_agent = None
                 customer.save()
+                invalidate_dashboard_stats([previous_agent_id])
                 return JsonResponse({
                     'success': True,
                     'message': 'Chat unassigned',
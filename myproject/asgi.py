@@ -5,6 +5,11 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Serve it with uvicorn workers to enable the live chat stream
+(``/chat/<id>/stream/``); under plain WSGI the dashboard falls back to polling:
+
+    gunicorn myproject.asgi:application -k uvicorn.workers.UvicornWorker
 """
 
 import os
@@ -12,5 +17,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+# Persistent connections are not reused across ASGI requests (each sync view
+# may run on another thread) and would pile up; see CONN_MAX_AGE in settings
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
@@ -12,9 +12,15 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 import os
 from pathlib import Path
 
+from dotenv import load_dotenv
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Deployment settings (database, tokens) may come from a .env file; real
+# environment variables win. See .env.example.
+load_dotenv(BASE_DIR / '.env')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -44,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'whatsapp.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,10 +83,86 @@ WSGI_APPLICATION = 'myproject.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+# SQLite tuned for several processes (web workers plus the queue workers).
+# WAL lets reads run alongside the single writer; IMMEDIATE transactions take
+# the write lock at BEGIN, so a writer waits up to `timeout` seconds instead
+# of failing with "database is locked" when upgrading from a read. Writes on
+# the webhook/worker paths go through whatsapp.db.serialized_write.
+# `python manage.py benchmark_sqlite` compares this with SQLite's defaults.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',  # persistent in the file; a no-op once set
+    'synchronous': 'NORMAL',  # with WAL a crash may lose the last commits but never corrupts
+    'mmap_size': 256 * 1024 * 1024,  # bytes of the file read through memory mapping
+    'cache_size': -64 * 1024,  # negative means KiB: 64 MB page cache per connection
+    'temp_store': 'MEMORY',
+}
+
+SQLITE_DATABASE = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.getenv('SQLITE_PATH') or BASE_DIR / 'db.sqlite3',
+    'OPTIONS': {
+        'init_command': '; '.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': 20,  # busy timeout in seconds
+    },
+    # Keep connections (and their page cache) between requests. Under ASGI
+    # requests run on changing threads and never reuse them, so asgi.py sets
+    # DB_CONN_MAX_AGE=0 unless the environment says otherwise.
+    'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '600')),
+    'CONN_HEALTH_CHECKS': True,
+}
+
+
+def postgres_database(host, port):
+    """PostgreSQL (psycopg 3) with Django's connection pool; POSTGRES_* come from the environment"""
+    return {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv('POSTGRES_DB'),
+        'USER': os.getenv('POSTGRES_USER', 'postgres'),
+        'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+        'HOST': host,
+        'PORT': port,
+        'OPTIONS': {
+            'pool': {
+                'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+                'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '10')),  # per process
+                'timeout': int(os.getenv('DB_POOL_TIMEOUT', '10')),  # seconds to wait for a free connection
+            },
+        },
+        # The pool keeps connections open; Django's persistent connections must stay off
+        'CONN_MAX_AGE': 0,
+    }
+
+
+# PostgreSQL when POSTGRES_DB is set, otherwise the SQLite file. With
+# PostgreSQL the SQLite file stays reachable as the 'sqlite' alias, the
+# source for `python manage.py migrate_sqlite_to_postgres`, and
+# POSTGRES_REPLICA_HOST adds a 'replica' alias for dashboard reads
+# (see whatsapp.db.ReplicaRouter).
+if os.getenv('POSTGRES_DB'):
+    DATABASES = {
+        'default': postgres_database(os.getenv('POSTGRES_HOST', 'localhost'), os.getenv('POSTGRES_PORT', '5432')),
+        'sqlite': SQLITE_DATABASE,
+    }
+    if os.getenv('POSTGRES_REPLICA_HOST'):
+        DATABASES['replica'] = postgres_database(
+            os.getenv('POSTGRES_REPLICA_HOST'), os.getenv('POSTGRES_REPLICA_PORT', os.getenv('POSTGRES_PORT', '5432'))
+        )
+        DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+else:
+    DATABASES = {'default': SQLITE_DATABASE}
+
+DATABASE_ROUTERS = ['whatsapp.db.ReplicaRouter']
+
+
+# Cache
+# Shared across worker processes so change stamps (chat streams, cached
+# tokens) written by one gunicorn/uvicorn worker are visible to the others.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache/'),
     }
 }
 
@@ -124,7 +207,110 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 # Media files (uploads)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
+# Media is served by dashboard.media.serve_media (access checked). In production
+# set MEDIA_SENDFILE to 'x-accel-redirect' (nginx, with an `internal` location at
+# MEDIA_ACCEL_REDIRECT_PREFIX aliased to MEDIA_ROOT) or 'x-sendfile' so the web
+# server sends the bytes.
+MEDIA_SENDFILE = os.getenv('MEDIA_SENDFILE') or None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+MEDIA_CACHE_MAX_AGE = 365 * 24 * 3600  # stored files never change in place
+MEDIA_SIGNED_URL_MAX_AGE = 24 * 3600  # seconds a signed link (used for Meta fetches) stays valid
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Chat live updates (Server-Sent Events, served only under ASGI)
+CHAT_STREAM_POLL_INTERVAL = 0.5  # seconds between change-stamp checks
+CHAT_STREAM_KEEPALIVE = 15  # seconds between keep-alive comments
+CHAT_STREAM_MAX_AGE = 300  # seconds before the stream closes and the browser reconnects
+CHAT_WINDOW_SIZE = 50  # messages loaded when a chat opens and per "load older" page
+
+
+# Webhook inbox (drained by `python manage.py process_webhooks`)
+WEBHOOK_INBOX_BATCH_SIZE = 50
+WEBHOOK_INBOX_MAX_ATTEMPTS = 5
+WEBHOOK_INBOX_VISIBILITY_TIMEOUT = 300  # seconds before an unfinished claim is retried
+WEBHOOK_INBOX_RETENTION_DAYS = 7  # processed payloads older than this are purged
+WEBHOOK_INBOX_BACKLOG_WARNING = 500  # pending payloads before the worker logs a warning
+
+
+# Inbound media downloads
+MEDIA_DOWNLOAD_WORKERS = 4  # concurrent downloads per process
+MEDIA_DOWNLOAD_MAX_BYTES = 100 * 1024 * 1024  # WhatsApp's own upper limit for documents
+MEDIA_DOWNLOAD_TIMEOUT = (5, 30)  # (connect, read) seconds
+MEDIA_DOWNLOAD_DEADLINE = 120  # seconds for a whole file
+
+
+# Graph API client (whatsapp.graph.graph_client)
+GRAPH_API_TIMEOUT = (3.05, 20)  # (connect, read) seconds
+GRAPH_API_MAX_RETRIES = 3  # retries on 429/5xx and connection failures
+GRAPH_API_BACKOFF = 0.5  # seconds; doubled per attempt with full jitter
+GRAPH_API_BACKOFF_MAX = 30  # cap for backoff and Retry-After
+GRAPH_API_POOL_SIZE = 20  # keep-alive connections per host per process
+
+
+# Access token cache (whatsapp.whatsapp_api.get_access_token)
+WHATSAPP_TOKEN_CACHE_TTL = 300  # seconds before a background re-read from the database
+WHATSAPP_TOKEN_VERSION_CHECK_INTERVAL = 5  # seconds between shared-cache invalidation checks
+
+
+# Template broadcasts (sent by `python manage.py run_broadcasts`)
+BROADCAST_RATE_PER_SECOND = 20  # default per job; keep under the number's Meta throughput tier
+BROADCAST_CONCURRENCY = 4  # parallel Graph API requests per job
+BROADCAST_MAX_ATTEMPTS = 3  # for throttling and temporary errors
+BROADCAST_RETRY_DELAY = 10  # seconds to wait before retrying throttled recipients
+BROADCAST_STALE_AFTER = 120  # seconds without a heartbeat before another worker takes over a job
+
+
+# Outbound queue for agent messages (sent by `python manage.py send_outbound`)
+OUTBOUND_LANES = 4  # parallel senders; customers are partitioned by id, so only change with an empty queue
+OUTBOUND_MAX_ATTEMPTS = 5  # after this the message is marked failed in the chat
+OUTBOUND_BACKOFF_MAX = 300  # seconds; retries back off 2, 4, 8 ... up to this
+OUTBOUND_VISIBILITY_TIMEOUT = 120  # seconds before a send claimed by a dead worker is retried
+WHATSAPP_MEDIA_ID_TTL = 29 * 24 * 3600  # uploaded media ids are reused this long (Meta keeps them 30 days)
+
+
+# Graph API send rate limits (whatsapp.ratelimit), shared by all processes.
+# Meta's throughput tiers are per business number; the pair limit is per
+# recipient (one message every 6 seconds, short bursts allowed).
+SEND_RATE_TIERS = {'standard': 80, 'high': 1000}  # messages per second
+SEND_RATE_TIER = os.getenv('SEND_RATE_TIER', 'standard')
+SEND_RATE_PAIR_PER_SECOND = 1 / 6
+SEND_RATE_PAIR_BURST = 20  # Meta tolerates up to 45 in 6 seconds, then blocks the pair
+SEND_RATE_INTERACTIVE_RESERVE = 0.25  # share of each burst that bulk (broadcast) sends leave for agent replies
+SEND_RATE_MAX_WAIT = 30  # seconds a send waits for a slot before giving up (outbox lanes use 2 and reschedule)
+SEND_RATE_THROTTLE_PAUSE = 2  # seconds all sends pause after Meta reports 130429
+
+
+# REST API list pagination (cursor based)
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000  # clients may ask for up to this with ?page_size=
+
+
+# Dashboard home stat cards
+DASHBOARD_STATS_TTL = 30  # seconds the counts may lag behind
+
+
+# Chat image thumbnails (generated at ingest and upload)
+THUMBNAIL_SIZE = (320, 320)  # bounding box in pixels
+THUMBNAIL_FORMAT = 'WEBP'  # falls back to JPEG if Pillow lacks WebP support
+THUMBNAIL_QUALITY = 70
+
+
+# Message archive (moved by `python manage.py archive_messages`, e.g. nightly from cron)
+MESSAGE_ARCHIVE_AFTER_DAYS = 90  # older messages leave the hot table and search; chats still page into them
+MESSAGE_ARCHIVE_BATCH_SIZE = 500  # messages moved per transaction
+MESSAGE_MEDIA_RETENTION_DAYS = None  # attachments of archived messages older than this are deleted; None keeps them
+
+
+# Message search (whatsapp.search)
+SEARCH_BACKEND = None  # dotted path; None picks SQLite FTS5 when the index exists, else LIKE scans
+SEARCH_RESULTS_LIMIT = 20  # default results per search; callers may ask for up to 100
+
+
+# Metrics (whatsapp.metrics), scraped from /metrics in Prometheus text format
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')  # scrapers send "Authorization: Bearer <token>"; superusers need none
+METRICS_PUBLISH_INTERVAL = 15  # seconds between each process's snapshot to the shared cache
+PAYLOAD_LOG_SAMPLE_RATE = 0.01  # share of webhook/API payloads logged (errors are always logged)
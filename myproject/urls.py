@@ -18,13 +18,15 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
-from django.conf.urls.static import static
+
+from dashboard.media import serve_media
+from whatsapp.views import metrics_view
 
 urlpatterns = [
     path('', include('dashboard.urls')),
     path('admin/', admin.site.urls),
     path('api/', include('whatsapp.urls')),
+    path('metrics', metrics_view, name='metrics'),
+    # Media is access controlled (and can be offloaded to the web server), in every environment
+    path(f"{settings.MEDIA_URL.strip('/')}/<path:path>", serve_media, name='media'),
 ]
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import WhatsAppConfig, Customer, Message, Template, Agent
+from .models import WhatsAppConfig, Customer, Message, ArchivedMessage, Template, Agent, InboundWebhook, BroadcastJob, BroadcastRecipient, OutboundMessage
 
 
 @admin.register(Agent)
@@ -20,7 +20,6 @@ class CustomerAdmin(admin.ModelAdmin):
 
 
 from django.utils.html import format_html
-from .whatsapp_api import send_whatsapp_message
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
@@ -28,6 +27,20 @@ class MessageAdmin(admin.ModelAdmin):
 	list_filter = ("direction", "status")
 	search_fields = ("customer__name", "customer__phone_number", "content")
 
+	def get_search_results(self, request, queryset, search_term):
+		# Content goes through the full-text index instead of a LIKE scan
+		term = search_term.strip()
+		if not term:
+			return queryset, False
+		from django.db.models import Q
+		from .search import get_backend
+		matches = (
+			Q(customer__name__icontains=term)
+			| Q(customer__phone_number__icontains=term)
+			| Q(id__in=get_backend().match_ids(term))
+		)
+		return queryset.filter(matches), False
+
 	def send_now(self, obj):
 		if obj.direction == 'sent':
 			return "Already sent"
@@ -50,13 +63,34 @@ class MessageAdmin(admin.ModelAdmin):
 		if obj.direction == 'sent':
 			self.message_user(request, "Message already sent.")
 		else:
-			resp = send_whatsapp_message(obj.customer.phone_number)
-			obj.direction = 'sent'
-			obj.status = 'pending'
-			obj.save()
-			self.message_user(request, f"WhatsApp message sent. API response: {resp}")
+			from django.db import transaction
+			from .conversations import refresh_summary
+			from .outbox import enqueue_message
+			with transaction.atomic():
+				obj.direction = 'sent'
+				obj.status = 'pending'
+				obj.save()
+				enqueue_message(obj, {'type': 'template', 'template_name': obj.template.name if obj.template else 'hello_world'})
+				# An existing row changed direction and status: recompute rather than fold in
+				refresh_summary(obj.customer_id)
+			self.message_user(request, "WhatsApp message queued; the send_outbound worker delivers it.")
 		return redirect(f'/admin/whatsapp/message/{message_id}/change/')
 
+@admin.register(ArchivedMessage)
+class ArchivedMessageAdmin(admin.ModelAdmin):
+	"""Read-only: rows are written by archive_messages"""
+	list_display = ("id", "customer", "direction", "status", "timestamp", "media_expired", "archived_at")
+	list_filter = ("direction", "media_expired")
+	search_fields = ("customer__name", "customer__phone_number")
+	raw_id_fields = ("customer", "template", "media_blob")
+	list_select_related = ("customer",)
+
+	def has_add_permission(self, request):
+		return False
+
+	def has_change_permission(self, request, obj=None):
+		return False
+
 @admin.register(Template)
 class TemplateAdmin(admin.ModelAdmin):
 	list_display = ("name", "language", "created_at")
@@ -64,9 +98,63 @@ class TemplateAdmin(admin.ModelAdmin):
 	actions = ["send_template_to_all_customers"]
 
 	def send_template_to_all_customers(self, request, queryset):
-		customers = Customer.objects.all()
-		for template in queryset:
-			for customer in customers:
-				send_whatsapp_message(customer.phone_number, template.name)
-		self.message_user(request, "Template(s) sent to all customers.")
+		from .broadcasts import enqueue_broadcast
+		jobs = [enqueue_broadcast(template) for template in queryset]
+		self.message_user(request, f"Queued {len(jobs)} broadcast(s) to {jobs[0].total if jobs else 0} customers; the run_broadcasts worker sends them.")
 	send_template_to_all_customers.short_description = "Send selected template(s) to all customers"
+
+
+@admin.register(BroadcastJob)
+class BroadcastJobAdmin(admin.ModelAdmin):
+	list_display = ("id", "template_name", "status", "progress", "sent_count", "failed_count", "throughput", "created_at")
+	list_filter = ("status",)
+	readonly_fields = ("total", "sent_count", "failed_count", "started_at", "finished_at", "heartbeat_at")
+	actions = ["cancel_jobs", "resume_jobs"]
+
+	def cancel_jobs(self, request, queryset):
+		count = queryset.filter(status__in=['queued', 'running']).update(status='cancelled')
+		self.message_user(request, f"Cancelled {count} broadcast(s).")
+	cancel_jobs.short_description = "Cancel selected broadcasts"
+
+	def resume_jobs(self, request, queryset):
+		count = queryset.filter(status='cancelled').update(status='queued')
+		self.message_user(request, f"Re-queued {count} broadcast(s); pending recipients will be sent.")
+	resume_jobs.short_description = "Resume selected broadcasts"
+
+
+@admin.register(BroadcastRecipient)
+class BroadcastRecipientAdmin(admin.ModelAdmin):
+	list_display = ("phone_number", "job", "status", "attempts", "sent_at")
+	list_filter = ("status",)
+	search_fields = ("phone_number",)
+	raw_id_fields = ("job", "customer")
+
+
+@admin.register(InboundWebhook)
+class InboundWebhookAdmin(admin.ModelAdmin):
+	list_display = ("id", "status", "attempts", "received_at", "processed_at")
+	list_filter = ("status",)
+	readonly_fields = ("received_at", "processed_at", "locked_at", "locked_by")
+	actions = ["replay_payloads"]
+
+	def replay_payloads(self, request, queryset):
+		from .inbox import replay
+		count = replay(queryset)
+		self.message_user(request, f"Re-queued {count} payload(s).")
+	replay_payloads.short_description = "Replay selected payloads"
+
+
+@admin.register(OutboundMessage)
+class OutboundMessageAdmin(admin.ModelAdmin):
+	list_display = ("id", "customer", "status", "lane", "attempts", "created_at", "sent_at")
+	list_filter = ("status", "lane")
+	search_fields = ("customer__phone_number",)
+	raw_id_fields = ("message", "customer")
+	readonly_fields = ("created_at", "sent_at", "locked_at", "locked_by")
+	actions = ["retry_sends"]
+
+	def retry_sends(self, request, queryset):
+		from .outbox import replay
+		count = replay(queryset)
+		self.message_user(request, f"Re-queued {count} failed send(s).")
+	retry_sends.short_description = "Retry selected failed sends"
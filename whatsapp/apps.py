@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class WhatsappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'whatsapp'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,143 @@
+"""
+Hot/cold split of the Message table.
+
+Agents rarely look further back than a few months, but every Message query
+(unread counts, previews, chat history, the admin changelist) works against
+the whole table. ``archive_messages`` moves messages older than
+MESSAGE_ARCHIVE_AFTER_DAYS into ArchivedMessage in bounded batches, each
+one short transaction: copy the rows, delete them from Message. Ids are
+kept, so the chat's "load older" pages continue into the archive with the
+same cursor (dashboard.views.get_older_messages).
+
+A message stays hot while something still depends on it: unread inbound
+messages (unread counts), each conversation's newest message (sidebar
+preview, summary rebuilds) and sends still in the outbound queue.
+
+Archived messages leave the hot table's full-text index and the
+/api/messages/ list: dashboard search and ``?q=`` only find messages newer
+than MESSAGE_ARCHIVE_AFTER_DAYS (plus those kept hot). The chat itself still
+pages through the whole history.
+
+Media retention runs in the same pass: archived messages older than
+MESSAGE_MEDIA_RETENTION_DAYS lose their attachment and thumbnail, and files
+nothing references any more are deleted.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import router
+from django.db.models import OuterRef, Q, Subquery
+from django.utils import timezone
+
+from .conversations import refresh_summary
+from .db import serialized_write
+from .media_store import refresh_ref_counts
+from .models import ArchivedMessage, ConversationSummary, MediaBlob, Message, OutboundMessage
+
+logger = logging.getLogger("whatsapp.archive")
+
+# Columns copied from Message; the archive adds archived_at and media_expired
+ARCHIVED_FIELDS = [
+    field.attname for field in ArchivedMessage._meta.concrete_fields
+    if field.attname not in ('archived_at', 'media_expired')
+]
+
+
+def archive_setting(name, default):
+    return getattr(settings, f'MESSAGE_ARCHIVE_{name}', default)
+
+
+def archive_cutoff(days=None):
+    return timezone.now() - timedelta(days=days or archive_setting('AFTER_DAYS', 90))
+
+
+def media_retention_cutoff(days=None):
+    days = days or getattr(settings, 'MESSAGE_MEDIA_RETENTION_DAYS', None)
+    return timezone.now() - timedelta(days=days) if days else None
+
+
+def archivable(cutoff):
+    """Messages older than ``cutoff`` that nothing in the hot path still needs"""
+    newest = Message.objects.filter(customer_id=OuterRef('customer_id')).order_by('-timestamp', '-id').values('id')[:1]
+    previews = ConversationSummary.objects.filter(last_message__isnull=False).values('last_message_id')
+    return (
+        Message.objects.filter(timestamp__lt=cutoff)
+        .exclude(direction='received', is_read=False)
+        .exclude(outbound__status__in=['pending', 'processing'])
+        .exclude(id=Subquery(newest))
+        .exclude(id__in=previews)
+    )
+
+
+@serialized_write
+def archive_batch(cutoff, batch_size):
+    """Move up to ``batch_size`` archivable messages; returns how many moved"""
+    ids = list(archivable(cutoff).order_by('id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return 0
+    rows = list(Message.objects.filter(id__in=ids).values(*ARCHIVED_FIELDS))
+    ArchivedMessage.objects.bulk_create([ArchivedMessage(**row) for row in rows])
+    # Raw deletes: a queryset delete() would send post_delete per message,
+    # each queueing a summary and a blob recount. Finished queue entries go
+    # first (the cascade), then one refresh per customer and blob; both come
+    # out unchanged, as the newest and unread messages stay hot and blob
+    # counts include the archive.
+    using = router.db_for_write(Message)
+    OutboundMessage.objects.filter(message_id__in=ids)._raw_delete(using)
+    Message.objects.filter(id__in=ids)._raw_delete(using)
+    for customer_id in {row['customer_id'] for row in rows}:
+        refresh_summary(customer_id, create=False)
+    refresh_ref_counts(row['media_blob_id'] for row in rows)
+    return len(ids)
+
+
+@serialized_write
+def expire_media_batch(cutoff, batch_size):
+    """Drop the attachments of up to ``batch_size`` archived messages older than ``cutoff``"""
+    rows = list(
+        ArchivedMessage.objects.filter(media__gt='', timestamp__lt=cutoff)
+        .order_by('timestamp').values_list('id', 'media', 'media_blob_id', 'thumbnail')[:batch_size]
+    )
+    if rows:
+        ArchivedMessage.objects.filter(id__in=[row[0] for row in rows]).update(
+            media='', media_blob=None, thumbnail='', placeholder='',
+            media_width=None, media_height=None, media_expired=True,
+        )
+    return rows
+
+
+def still_referenced(names):
+    """The subset of ``names`` some hot or archived message still uses as media or thumbnail"""
+    names = list(names)
+    used = set()
+    for model in (Message, ArchivedMessage):
+        for media, thumbnail in model.objects.filter(Q(media__in=names) | Q(thumbnail__in=names)).values_list('media', 'thumbnail'):
+            used.update((media, thumbnail))
+    return used
+
+
+def delete_expired_files(rows):
+    """
+    Delete the files behind expired attachments once nothing uses them.
+    Blob files are left to prune_unreferenced; their thumbnails (named after
+    the content hash) go when the blob has no references left.
+    """
+    blob_ids = {blob_id for _, _, blob_id, _ in rows if blob_id}
+    refresh_ref_counts(blob_ids)
+    unused_blobs = set(MediaBlob.objects.filter(id__in=blob_ids, ref_count=0).values_list('id', flat=True))
+    candidates = set()
+    for _, media, blob_id, thumbnail in rows:
+        if blob_id is None and media:
+            candidates.add(media)
+        if thumbnail and (blob_id is None or blob_id in unused_blobs):
+            candidates.add(thumbnail)
+    if not candidates:
+        return 0
+    deleted = 0
+    for name in candidates - still_referenced(candidates):
+        if default_storage.exists(name):
+            default_storage.delete(name)
+            deleted += 1
+    return deleted
@@ -0,0 +1,213 @@
+"""
+Template broadcast campaigns.
+
+The admin only enqueues a BroadcastJob with one BroadcastRecipient row per
+customer; the ``run_broadcasts`` worker sends through a token-bucket rate
+limiter with a bounded number of parallel requests, records every outcome
+and resumes from the remaining pending recipients after a restart. Sends
+also take bulk-priority slots from the shared limits in whatsapp.ratelimit.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .db import serialized_write
+from .graph import never_sent
+from .metrics import publish, set_role
+from .models import BroadcastJob, BroadcastRecipient, Customer
+from .ratelimit import BULK, RateLimited
+from .whatsapp_api import extract_message_id, get_access_token, is_retryable_error, response_error, send_whatsapp_message
+
+logger = logging.getLogger("whatsapp.broadcast")
+
+CHUNK_SIZE = 200
+# Results are written back at least this often, bounding re-sends after a crash
+FLUSH_EVERY = 25
+FLUSH_INTERVAL = 15  # seconds
+
+
+def broadcast_setting(name, default):
+    return getattr(settings, f'BROADCAST_{name}', default)
+
+
+class TokenBucket:
+    """Thread-safe token bucket: ``rate`` tokens per second, bursts up to ``capacity``"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def enqueue_broadcast(template, customers=None, rate_per_second=None, concurrency=None):
+    """Create a job and its recipient rows; sending happens in the worker"""
+    customers = Customer.objects.all() if customers is None else customers
+    with transaction.atomic():
+        job = BroadcastJob.objects.create(
+            template=template,
+            template_name=template.name,
+            rate_per_second=rate_per_second or broadcast_setting('RATE_PER_SECOND', 20),
+            concurrency=concurrency or broadcast_setting('CONCURRENCY', 4),
+        )
+        total = 0
+        batch = []
+        for customer_id, phone_number in customers.order_by('id').values_list('id', 'phone_number').iterator():
+            batch.append(BroadcastRecipient(job=job, customer_id=customer_id, phone_number=phone_number))
+            if len(batch) >= 1000:
+                BroadcastRecipient.objects.bulk_create(batch)
+                total += len(batch)
+                batch = []
+        BroadcastRecipient.objects.bulk_create(batch)
+        total += len(batch)
+        BroadcastJob.objects.filter(id=job.id).update(total=total)
+    job.total = total
+    logger.info(f"Queued broadcast #{job.id} of '{template.name}' to {total} customers")
+    return job
+
+
+@serialized_write
+def claim_job():
+    """Claim the oldest queued job, or a running one whose worker stopped reporting"""
+    now = timezone.now()
+    stale = now - timedelta(seconds=broadcast_setting('STALE_AFTER', 120))
+    claimable = Q(status='queued') | Q(status='running', heartbeat_at__lt=stale)
+    job = BroadcastJob.objects.filter(claimable).order_by('created_at', 'id').first()
+    # The conditional UPDATE makes sure only one worker wins the job
+    if job and BroadcastJob.objects.filter(claimable, id=job.id).update(status='running', heartbeat_at=now):
+        return job
+    return None
+
+
+def send_one(bucket, recipient_id, phone_number, template_name):
+    bucket.acquire()
+    try:
+        # Bulk priority: agent replies sharing the number's rate limit go first
+        return recipient_id, send_whatsapp_message(phone_number, template_name, priority=BULK), None
+    except (requests.RequestException, RateLimited) as exc:
+        return recipient_id, None, exc
+    finally:
+        # Taking rate-limit tokens opened a connection in this pool thread;
+        # hand it back rather than hold a (pooled) connection per thread
+        connection.close()
+
+
+@serialized_write
+def flush_results(job, results, max_attempts):
+    """Persist a set of send outcomes and bump the job counters"""
+    now = timezone.now()
+    recipients = BroadcastRecipient.objects.in_bulk([recipient_id for recipient_id, _, _ in results])
+    sent = failed = retried = 0
+    for recipient_id, api_response, exc in results:
+        recipient = recipients[recipient_id]
+        recipient.attempts += 1
+        wa_id = extract_message_id(api_response) if exc is None else None
+        if wa_id:
+            recipient.status, recipient.whatsapp_message_id, recipient.sent_at, recipient.error = 'sent', wa_id, now, ''
+            sent += 1
+            continue
+        if exc is not None:
+            recipient.error = f"{type(exc).__name__}: {exc}"
+            # Only when the template certainly did not go out: after a read
+            # timeout a resend could reach the customer twice
+            retryable = isinstance(exc, RateLimited) or never_sent(exc)
+        else:
+            code, message = response_error(api_response)
+            recipient.error = f"{code}: {message}" if code else f"Unexpected response: {api_response}"
+            retryable = is_retryable_error(api_response)
+        if not retryable or recipient.attempts >= max_attempts:
+            recipient.status = 'failed'
+            failed += 1
+        else:
+            retried += 1
+    BroadcastRecipient.objects.bulk_update(
+        recipients.values(), ['status', 'attempts', 'whatsapp_message_id', 'sent_at', 'error']
+    )
+    BroadcastJob.objects.filter(id=job.id).update(
+        sent_count=F('sent_count') + sent,
+        failed_count=F('failed_count') + failed,
+        heartbeat_at=now,
+    )
+    return retried
+
+
+def run_job(job):
+    """Send every pending recipient of a job; safe to call again after a crash"""
+    max_attempts = broadcast_setting('MAX_ATTEMPTS', 3)
+    if not job.started_at:
+        BroadcastJob.objects.filter(id=job.id).update(started_at=timezone.now())
+    bucket = TokenBucket(job.rate_per_second)
+    get_access_token()  # warm the token cache before the send threads start
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=job.concurrency, thread_name_prefix=f'broadcast-{job.id}') as executor:
+        while True:
+            job.refresh_from_db(fields=['status'])
+            if job.status == 'cancelled':
+                logger.info(f"Broadcast #{job.id} cancelled")
+                return
+            chunk = list(
+                job.recipients.filter(status='pending').order_by('id')
+                .values_list('id', 'phone_number')[:CHUNK_SIZE]
+            )
+            if not chunk:
+                break
+            futures = [executor.submit(send_one, bucket, recipient_id, phone, job.template_name) for recipient_id, phone in chunk]
+            results = []
+            retried = 0
+            last_flush = time.monotonic()
+            for future in as_completed(futures):
+                results.append(future.result())
+                # Flushing also refreshes the heartbeat that keeps other workers off this job
+                if len(results) >= FLUSH_EVERY or time.monotonic() - last_flush > FLUSH_INTERVAL:
+                    retried += flush_results(job, results, max_attempts)
+                    results = []
+                    last_flush = time.monotonic()
+            if results:
+                retried += flush_results(job, results, max_attempts)
+            publish()
+            job.refresh_from_db(fields=['sent_count', 'failed_count', 'total'])
+            elapsed = time.monotonic() - started
+            logger.info(
+                f"Broadcast #{job.id}: {job.progress()} sent={job.sent_count} failed={job.failed_count} "
+                f"rate={len(chunk) / elapsed if elapsed else 0:.1f}/s"
+            )
+            if retried:
+                # Throttled or temporary errors: give Meta a moment before the retry round
+                time.sleep(broadcast_setting('RETRY_DELAY', 10))
+            started = time.monotonic()
+    BroadcastJob.objects.filter(id=job.id, status='running').update(status='completed', finished_at=timezone.now())
+    logger.info(f"Broadcast #{job.id} completed")
+
+
+def run_worker(poll_interval=5.0, once=False):
+    set_role('broadcasts')
+    while True:
+        job = claim_job()
+        if job:
+            run_job(job)
+            publish()
+        elif once:
+            return
+        else:
+            time.sleep(poll_interval)
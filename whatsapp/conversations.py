@@ -0,0 +1,143 @@
+"""
+Maintenance of ConversationSummary rows.
+
+Every code path that writes messages reports them here so the dashboard
+sidebar can be served from one query over the summaries instead of a
+per-customer "last message" lookup.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+
+from .models import ConversationSummary, Customer, Message
+
+PREVIEW_LENGTH = 30
+
+
+def build_preview(content, media, media_type):
+    """Return (preview, media_kind) for the sidebar, as shown next to each contact"""
+    content = content or ''
+    preview = content[:PREVIEW_LENGTH] + '...' if len(content) > PREVIEW_LENGTH else content
+    media_kind = ''
+    if media:
+        media_kind = 'image' if 'image' in (media_type or '') else 'file'
+        if not content:
+            preview = '📷 Photo' if media_kind == 'image' else '📎 File'
+    return preview, media_kind
+
+
+def summary_fields(message):
+    preview, media_kind = build_preview(message.content, message.media, message.media_type)
+    return {
+        'last_message_id': message.id,
+        'last_message_at': message.timestamp,
+        'last_direction': message.direction,
+        'last_status': message.status,
+        'preview': preview,
+        'media_kind': media_kind,
+    }
+
+
+def record_messages(messages):
+    """Fold newly stored messages into their customers' summaries"""
+    by_customer = {}
+    for message in messages:
+        by_customer.setdefault(message.customer_id, []).append(message)
+    existing = set(
+        ConversationSummary.objects.filter(customer_id__in=by_customer).values_list('customer_id', flat=True)
+    )
+    # New conversations: build their rows from the Message table in one pass
+    missing = [customer_id for customer_id in by_customer if customer_id not in existing]
+    if missing:
+        backfill_summaries(missing)
+    for customer_id in existing:
+        customer_messages = by_customer[customer_id]
+        latest = max(customer_messages, key=lambda m: m.id)
+        unread = sum(1 for m in customer_messages if m.direction == 'received' and not m.is_read)
+        summaries = ConversationSummary.objects.filter(customer_id=customer_id)
+        updated = summaries.filter(Q(last_message__isnull=True) | Q(last_message_id__lt=latest.id)).update(
+            unread_count=F('unread_count') + unread, **summary_fields(latest)
+        )
+        if not updated and unread:
+            summaries.update(unread_count=F('unread_count') + unread)
+
+
+def record_message(message):
+    record_messages([message])
+
+
+def record_status_changes(message_ids):
+    """Refresh the tick shown for conversations whose last message changed status"""
+    last_status = Message.objects.filter(id=OuterRef('last_message_id')).values('status')[:1]
+    ConversationSummary.objects.filter(last_message_id__in=message_ids).update(last_status=Subquery(last_status))
+
+
+def mark_read(customer_id):
+    """
+    Mark inbound messages newer than the read watermark as read.
+
+    Opening a chat with nothing new costs two indexed reads and no write.
+    """
+    watermark = ConversationSummary.objects.filter(customer_id=customer_id).values_list('last_read_id', flat=True).first()
+    newest = (
+        Message.objects.filter(customer_id=customer_id, direction='received')
+        .order_by('-id').values_list('id', flat=True).first()
+    )
+    if newest is None or (watermark is not None and newest <= watermark):
+        return 0
+    unread = Message.objects.filter(customer_id=customer_id, direction='received', is_read=False, id__lte=newest)
+    if watermark is not None:
+        unread = unread.filter(id__gt=watermark)
+    with transaction.atomic():
+        count = unread.update(is_read=True)
+        ConversationSummary.objects.filter(customer_id=customer_id).update(last_read_id=newest, unread_count=0)
+    return count
+
+
+def refresh_summary(customer_id, create=True):
+    """Recompute a summary from the Message table (backfill and repair path)"""
+    last = Message.objects.filter(customer_id=customer_id).order_by('-timestamp', '-id').first()
+    unread = Message.objects.filter(customer_id=customer_id, direction='received', is_read=False).count()
+    fields = summary_fields(last) if last else {
+        'last_message_id': None, 'last_message_at': None, 'last_direction': '',
+        'last_status': '', 'preview': '', 'media_kind': '',
+    }
+    fields['unread_count'] = unread
+    if ConversationSummary.objects.filter(customer_id=customer_id).update(**fields) or not create:
+        return
+    try:
+        with transaction.atomic():
+            ConversationSummary.objects.create(customer_id=customer_id, **fields)
+    except IntegrityError:
+        # Created concurrently; our values are just as current
+        ConversationSummary.objects.filter(customer_id=customer_id).update(**fields)
+
+
+def backfill_summaries(customer_ids):
+    """Set-based rebuild for a chunk of customers; returns the number of rows written"""
+    latest_id = Message.objects.filter(customer_id=OuterRef('pk')).order_by('-timestamp', '-id').values('id')[:1]
+    rows = (
+        Customer.objects.filter(id__in=customer_ids)
+        .annotate(
+            last_id=Subquery(latest_id),
+            unread=Count('messages', filter=Q(messages__direction='received', messages__is_read=False)),
+        )
+        .values_list('id', 'last_id', 'unread')
+    )
+    rows = list(rows)
+    last_messages = Message.objects.only(
+        'id', 'customer_id', 'timestamp', 'direction', 'status', 'content', 'media', 'media_type'
+    ).in_bulk([last_id for _, last_id, _ in rows if last_id])
+    summaries = []
+    for customer_id, last_id, unread in rows:
+        summary = ConversationSummary(customer_id=customer_id, unread_count=unread)
+        if last_id:
+            for field, value in summary_fields(last_messages[last_id]).items():
+                setattr(summary, field, value)
+        summaries.append(summary)
+    ConversationSummary.objects.bulk_create(
+        summaries,
+        update_conflicts=True,
+        unique_fields=['customer'],
+        update_fields=['last_message', 'last_message_at', 'last_direction', 'last_status', 'preview', 'media_kind', 'unread_count'],
+    )
+    return len(summaries)
@@ -0,0 +1,127 @@
+"""
+Serialized writes for the webhook and worker paths.
+
+SQLite has a single writer. The settings make every transaction
+``BEGIN IMMEDIATE`` with a busy timeout, so writers in different processes
+queue on the database lock instead of failing when a read transaction
+tries to upgrade. Within a process, writers (outbox lanes, broadcast send
+threads, web threads) also take a process-wide lock first: SQLite's busy
+handler polls with sleeps and can starve a waiter, a lock hands over in
+order. ``serialized_write`` additionally retries the whole transaction if
+SQLite still reports the database locked after the timeout.
+
+On other databases both are plain ``transaction.atomic()``.
+
+``ReplicaRouter`` sends reads made under ``replica_reads`` (dashboard
+views that tolerate a little replication lag) to the 'replica' alias when
+one is configured. Writes, and reads inside a transaction, stay on
+'default'.
+"""
+import contextvars
+import functools
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+logger = logging.getLogger("whatsapp.db")
+
+_write_locks = {}
+_write_locks_guard = threading.Lock()
+
+
+def write_lock(using):
+    with _write_locks_guard:
+        return _write_locks.setdefault(using, threading.RLock())
+
+
+def is_locked_error(exc):
+    message = str(exc).lower()
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+@contextmanager
+def serialized_transaction(using=DEFAULT_DB_ALIAS):
+    """``transaction.atomic()`` that queues behind this process's other writers on SQLite"""
+    if connections[using].vendor != 'sqlite':
+        with transaction.atomic(using=using):
+            yield
+        return
+    with write_lock(using), transaction.atomic(using=using):
+        yield
+
+
+def serialized_write(func=None, *, using=DEFAULT_DB_ALIAS, attempts=3):
+    """
+    Run the decorated function in a serialized transaction, retrying it
+    when SQLite reports the database locked. Only decorate functions that
+    touch nothing but the database: a retry runs them again.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if connections[using].in_atomic_block:
+                # Part of the caller's transaction, which owns retries
+                with serialized_transaction(using):
+                    return func(*args, **kwargs)
+            for attempt in range(attempts):
+                try:
+                    with serialized_transaction(using):
+                        return func(*args, **kwargs)
+                except OperationalError as exc:
+                    if not is_locked_error(exc) or attempt == attempts - 1:
+                        raise
+                    delay = random.uniform(0.05, 0.2) * (2 ** attempt)
+                    logger.warning(f"{func.__qualname__}: database locked, retrying in {delay:.2f}s")
+                    time.sleep(delay)
+        return wrapper
+    return decorator(func) if func is not None else decorator
+
+
+REPLICA_ALIAS = 'replica'
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+
+
+def replica_reads(view):
+    """Route the view's reads to the replica (when configured)"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = _replica_reads.set(True)
+        try:
+            return view(*args, **kwargs)
+        finally:
+            _replica_reads.reset(token)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get() or REPLICA_ALIAS not in settings.DATABASES:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # Reads inside a transaction must see its own writes
+            return None
+        return REPLICA_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # Rows read from the replica are saved to the primary
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db == REPLICA_ALIAS:
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPLICA_ALIAS}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema through replication
+        if db == REPLICA_ALIAS:
+            return False
+        return None
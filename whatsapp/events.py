@@ -0,0 +1,30 @@
+"""
+Change notifications for live chat streams.
+
+Writers call ``notify_customer`` after changing a customer's messages. The
+change stamp lives in the shared cache, so a write handled by one worker
+process is visible to streams served by any other; stream readers compare
+stamps (a cache read) and only query the database when the stamp moves.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'chat:version:{}'
+
+
+def notify_customer(customer_id):
+    """Bump the customer's change stamp once the current transaction commits"""
+    transaction.on_commit(
+        lambda: cache.set(VERSION_KEY.format(customer_id), time.time_ns(), timeout=None)
+    )
+
+
+def notify_customers(customer_ids):
+    for customer_id in set(customer_ids):
+        notify_customer(customer_id)
+
+
+async def acustomer_version(customer_id):
+    return await cache.aget(VERSION_KEY.format(customer_id))
@@ -0,0 +1,196 @@
+"""
+Shared client for the Meta Graph API.
+
+One pooled keep-alive ``requests.Session`` per process (re-created after a
+fork), default connect/read timeouts, and jittered exponential retries that
+honour ``Retry-After``: on 429/5xx for idempotent requests, on 429 only
+for the rest (a 5xx after a POST /messages may still have been sent). Latency and Graph error codes are
+recorded per endpoint (see whatsapp.metrics).
+"""
+import logging
+import os
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+
+from .metrics import registry
+
+logger = logging.getLogger("whatsapp.graph")
+
+GRAPH_API_URL = "https://graph.facebook.com/v19.0"
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Statuses meaning the request was refused before doing anything
+REJECTED_STATUSES = frozenset({429})
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'DELETE'})
+NUMERIC_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+def never_sent(exc):
+    """
+    True when a ``requests`` error was raised before the request was written:
+    a connect timeout, or a connection that could not be established
+    (refused, DNS). A reset or timeout afterwards may follow a delivered request.
+    """
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0], 'reason', None) if isinstance(exc, requests.ConnectionError) and exc.args else None
+    # urllib3 raises NewConnectionError (a ConnectTimeoutError) when connecting fails
+    return isinstance(reason, ConnectTimeoutError)
+
+
+class GraphClient:
+    def __init__(self, base_url=GRAPH_API_URL):
+        self.base_url = base_url.rstrip('/')
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    def setting(self, name, default):
+        return getattr(settings, f'GRAPH_API_{name}', default)
+
+    @property
+    def session(self):
+        # Sessions must not be shared across a fork (gunicorn preload, workers)
+        if self._session is None or self._session_pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._session_pid != os.getpid():
+                    pool_size = self.setting('POOL_SIZE', 20)
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+                    self._session_pid = os.getpid()
+        return self._session
+
+    def url_for(self, path):
+        if path.startswith(('http://', 'https://')):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def endpoint_label(self, url):
+        """Stable label for stats: ids collapsed, e.g. '/v19.0/{id}/messages'"""
+        parts = urlsplit(url)
+        if parts.netloc != urlsplit(self.base_url).netloc:
+            return parts.netloc
+        return NUMERIC_SEGMENT.sub('/{id}', parts.path)
+
+    def backoff(self, attempt):
+        base = self.setting('BACKOFF', 0.5)
+        cap = self.setting('BACKOFF_MAX', 30)
+        # Full jitter keeps many workers from retrying in lockstep
+        return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+    def retry_after(self, response):
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        cap = self.setting('BACKOFF_MAX', 30)
+        try:
+            return min(cap, max(0.0, float(value)))
+        except ValueError:
+            try:
+                return min(cap, max(0.0, parsedate_to_datetime(value).timestamp() - time.time()))
+            except (TypeError, ValueError):
+                return None
+
+    def error_code(self, response):
+        """Graph's own error code from an error response body, e.g. 131056"""
+        try:
+            return response.json()['error']['code']
+        except (ValueError, KeyError, TypeError):
+            return 'unknown'
+
+    def record(self, endpoint, elapsed, status_code, error_code=None):
+        registry.observe('graph_request_duration_seconds', elapsed, {'endpoint': endpoint, 'status': status_code or 'error'})
+        if error_code is not None:
+            registry.inc('graph_errors_total', {'endpoint': endpoint, 'code': error_code})
+        with self._lock:
+            stats = self.stats.setdefault(endpoint, {
+                'count': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0, 'status_codes': {},
+            })
+            stats['count'] += 1
+            stats['total_seconds'] += elapsed
+            stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+            if status_code is None or status_code >= 400:
+                stats['errors'] += 1
+            key = status_code or 'error'
+            stats['status_codes'][key] = stats['status_codes'].get(key, 0) + 1
+        logger.debug(f"Graph {endpoint}: status={status_code} elapsed={elapsed * 1000:.0f}ms")
+
+    def request(self, method, path, auth=True, endpoint=None, idempotent=None, **kwargs):
+        """
+        Send a request and return the ``requests.Response``.
+
+        ``auth`` adds the stored access token. Idempotent requests (GET and
+        friends by default; pass ``idempotent=True`` for POSTs that are safe
+        to repeat, like uploads) are retried on 429/5xx and network errors.
+        Others are retried only when they cannot have taken effect: a 429, or
+        a connection that could not be established.
+        """
+        from .whatsapp_api import get_access_token
+
+        method = method.upper()
+        url = self.url_for(path)
+        endpoint = endpoint or self.endpoint_label(url)
+        headers = dict(kwargs.pop('headers', None) or {})
+        if auth:
+            headers.setdefault('Authorization', f"Bearer {get_access_token()}")
+        kwargs.setdefault('timeout', self.setting('TIMEOUT', (3.05, 20)))
+        max_retries = self.setting('MAX_RETRIES', 3)
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        retry_statuses = RETRY_STATUSES if idempotent else REJECTED_STATUSES
+
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, url, headers=headers, **kwargs)
+            except requests.RequestException as exc:
+                self.record(endpoint, time.monotonic() - started, None, type(exc).__name__)
+                safe = idempotent or never_sent(exc)
+                if attempt >= max_retries or not safe:
+                    raise
+                delay = self.backoff(attempt)
+                logger.warning(f"Graph {method} {endpoint} failed ({exc}); retrying in {delay:.1f}s")
+            else:
+                elapsed = time.monotonic() - started
+                error_code = self.error_code(response) if response.status_code >= 400 else None
+                self.record(endpoint, elapsed, response.status_code, error_code)
+                if response.status_code not in retry_statuses or attempt >= max_retries:
+                    return response
+                delay = self.retry_after(response)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                logger.warning(f"Graph {method} {endpoint} returned {response.status_code}; retrying in {delay:.1f}s")
+                response.close()
+            time.sleep(delay)
+            # Uploads read their file objects to the end; resend them from the start
+            for value in (kwargs.get('files') or {}).values():
+                fileobj = value[1] if isinstance(value, tuple) else value
+                if hasattr(fileobj, 'seek'):
+                    fileobj.seek(0)
+            attempt += 1
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def latency_snapshot(self):
+        with self._lock:
+            return {endpoint: dict(stats, status_codes=dict(stats['status_codes'])) for endpoint, stats in self.stats.items()}
+
+
+graph_client = GraphClient()
@@ -0,0 +1,182 @@
+"""
+Durable inbox for webhook payloads.
+
+The webhook view stores each payload and returns immediately; the
+``process_webhooks`` worker claims batches, processes them and records the
+outcome. Delivery is at least once: a claim that is not completed within the
+visibility timeout (worker crash, deploy) becomes claimable again.
+"""
+import logging
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from .db import serialized_transaction, serialized_write
+from .ingest import apply_statuses, process_webhook_payload
+from .metrics import publish, registry, set_role
+from .models import InboundWebhook
+
+logger = logging.getLogger("whatsapp.inbox")
+
+
+def inbox_setting(name, default):
+    return getattr(settings, f'WEBHOOK_INBOX_{name}', default)
+
+
+@serialized_write
+def enqueue_webhook(payload):
+    return InboundWebhook.objects.create(payload=payload)
+
+
+@serialized_write
+def claim_batch(batch_size=None, visibility_timeout=None):
+    """Atomically claim up to batch_size due payloads for this worker"""
+    batch_size = batch_size or inbox_setting('BATCH_SIZE', 50)
+    visibility_timeout = visibility_timeout or inbox_setting('VISIBILITY_TIMEOUT', 300)
+    now = timezone.now()
+    claimable = (
+        Q(status='pending', available_at__lte=now)
+        | Q(status='processing', locked_at__lt=now - timedelta(seconds=visibility_timeout))
+    )
+    ids = list(
+        InboundWebhook.objects.filter(claimable)
+        .order_by('id')
+        .values_list('id', flat=True)[:batch_size]
+    )
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    # Re-check the claim condition in the UPDATE so concurrent workers never share a row
+    InboundWebhook.objects.filter(claimable, id__in=ids).update(
+        status='processing', locked_at=now, locked_by=token,
+    )
+    return list(InboundWebhook.objects.filter(locked_by=token, status='processing').order_by('id'))
+
+
+@serialized_write
+def record_failure(item, error, max_attempts):
+    retry = item.attempts < max_attempts
+    InboundWebhook.objects.filter(id=item.id, locked_by=item.locked_by).update(
+        status='pending' if retry else 'failed',
+        attempts=item.attempts,
+        last_error=error,
+        # Exponential backoff: 2, 4, 8 ... seconds, capped at 5 minutes
+        available_at=timezone.now() + timedelta(seconds=min(2 ** item.attempts, 300)),
+        locked_at=None,
+        locked_by='',
+    )
+
+
+def process_batch(batch):
+    """
+    Process claimed payloads; returns (processed, failed).
+
+    Messages are stored one payload per transaction (media downloads happen
+    before it, outside any transaction). Status events from the whole batch
+    are then coalesced and applied together, so a batch of
+    "sent/delivered/read" ticks costs a handful of statements.
+    """
+    max_attempts = inbox_setting('MAX_ATTEMPTS', 5)
+    stored = []
+    status_events = []
+    for item in batch:
+        item.attempts += 1
+        try:
+            status_events.extend(process_webhook_payload(item.payload, defer_statuses=True))
+        except Exception:
+            logger.exception(f"Webhook #{item.id} failed (attempt {item.attempts})")
+            record_failure(item, traceback.format_exc(), max_attempts)
+        else:
+            stored.append(item)
+
+    try:
+        with serialized_transaction():
+            apply_statuses(status_events)
+    except Exception:
+        # Stored messages are deduped on retry, so the whole batch can be redone
+        logger.exception("Applying batched status updates failed")
+        error = traceback.format_exc()
+        for item in stored:
+            record_failure(item, error, max_attempts)
+        return 0, len(batch)
+
+    if stored:
+        mark_processed(stored)
+    return len(stored), len(batch) - len(stored)
+
+
+@serialized_write
+def mark_processed(items):
+    # One UPDATE for the batch; all rows of a claim share its token
+    InboundWebhook.objects.filter(id__in=[item.id for item in items], locked_by=items[0].locked_by).update(
+        status='processed',
+        attempts=F('attempts') + 1,
+        last_error='',
+        processed_at=timezone.now(),
+        locked_at=None,
+        locked_by='',
+    )
+
+
+def replay(queryset):
+    """Put payloads (typically failed ones) back in the queue with a fresh retry budget"""
+    return queryset.update(
+        status='pending', attempts=0, available_at=timezone.now(), locked_at=None, locked_by='',
+    )
+
+
+def purge_processed(retention_days=None):
+    retention_days = retention_days or inbox_setting('RETENTION_DAYS', 7)
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    deleted, _ = InboundWebhook.objects.filter(status='processed', processed_at__lt=cutoff).delete()
+    return deleted
+
+
+def inbox_stats():
+    """Backpressure snapshot: queue depth per status and age of the oldest pending payload"""
+    counts = InboundWebhook.objects.exclude(status='processed').aggregate(
+        pending=Count('id', filter=Q(status='pending')),
+        processing=Count('id', filter=Q(status='processing')),
+        failed=Count('id', filter=Q(status='failed')),
+        oldest_pending=Min('received_at', filter=Q(status='pending')),
+    )
+    oldest = counts.pop('oldest_pending')
+    counts['lag_seconds'] = (timezone.now() - oldest).total_seconds() if oldest else 0.0
+    return counts
+
+
+def run_worker(batch_size=None, poll_interval=1.0, once=False):
+    """Drain the inbox until interrupted (or once, for cron-style runs)"""
+    set_role('inbox')
+    backlog_warning = inbox_setting('BACKLOG_WARNING', 500)
+    last_purge = 0.0
+    while True:
+        started = time.monotonic()
+        batch = claim_batch(batch_size)
+        if batch:
+            processed, failed = process_batch(batch)
+            elapsed = time.monotonic() - started
+            registry.observe('inbox_batch_duration_seconds', elapsed)
+            registry.inc('inbox_processed_total', {'result': 'processed'}, processed)
+            registry.inc('inbox_processed_total', {'result': 'failed'}, failed)
+            stats = inbox_stats()
+            logger.info(
+                f"Inbox batch: processed={processed} failed={failed} "
+                f"elapsed={elapsed:.2f}s rate={len(batch) / elapsed if elapsed else 0:.1f}/s "
+                f"pending={stats['pending']} lag={stats['lag_seconds']:.1f}s"
+            )
+            if stats['pending'] > backlog_warning:
+                logger.warning(f"Inbox backlog is {stats['pending']} payloads ({stats['lag_seconds']:.0f}s behind)")
+        publish()
+        if time.monotonic() - last_purge > 3600:
+            purge_processed()
+            last_purge = time.monotonic()
+        if once and not batch:
+            return
+        if not batch:
+            time.sleep(poll_interval)
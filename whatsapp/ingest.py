@@ -0,0 +1,259 @@
+"""
+Processing of WhatsApp webhook payloads.
+
+The webhook view only stores payloads in the inbox (see ``inbox.py``); the
+worker hands each stored payload to ``process_webhook_payload``. Processing
+must stay idempotent because the inbox delivers at least once.
+"""
+import logging
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .conversations import record_messages, record_status_changes
+from .db import serialized_transaction
+from .events import notify_customers
+from .media_downloader import download_many
+from .media_store import refresh_ref_counts, register_blobs
+from .models import Customer, Message
+from .thumbnails import apply_thumbnail, render_thumbnail
+from .whatsapp_api import get_access_token
+
+logger = logging.getLogger("whatsapp.webhook")
+
+MEDIA_MESSAGE_TYPES = ('image', 'document', 'video', 'audio')
+
+
+def normalize_phone(phone):
+    """
+    Normalize phone number to E.164 format (always with '+').
+    Assumes WhatsApp always sends numbers in international format (no +).
+    """
+    if not phone:
+        return ''
+    phone = str(phone).strip().replace(' ', '').replace('-', '')
+    if phone.startswith('+'):
+        phone = phone[1:]
+    phone = phone.lstrip('0')
+    # Always add '+' for storage/search
+    return f'+{phone}'
+
+
+def process_webhook_payload(data, defer_statuses=False):
+    """
+    Apply one webhook payload: store inbound messages, then delivery/read statuses.
+
+    With ``defer_statuses`` the status events are returned instead of applied,
+    so the inbox worker can coalesce them across a whole batch.
+    """
+    entry = data.get('entry', [])
+    inbound = []
+    status_events = []
+    for ent in entry:
+        changes = ent.get('changes', [])
+        for change in changes:
+            value = change.get('value', {})
+            messages = value.get('messages', [])
+            statuses = value.get('statuses', [])
+            contacts = value.get('contacts', [])
+
+            # Build a map of wa_id -> profile name from contacts
+            contact_names = {}
+            for contact in contacts:
+                wa_id = contact.get('wa_id')
+                profile = contact.get('profile', {})
+                name = profile.get('name', '')
+                if wa_id and name:
+                    contact_names[wa_id] = name
+
+            logger.debug(f"Processing {len(messages)} messages, {len(statuses)} statuses, contacts: {contact_names}")
+            inbound.extend((msg, contact_names) for msg in messages)
+            status_events.extend(statuses)
+
+    # Handle incoming messages
+    store_inbound_messages(inbound)
+
+    # Handle delivery/read statuses
+    if defer_statuses:
+        return status_events
+    apply_statuses(status_events)
+    return []
+
+
+# Delivery progress; a message never moves back down this order
+STATUS_RANK = {'pending': 0, 'sent': 1, 'delivered': 2, 'read': 3}
+
+
+def coalesce_statuses(status_events):
+    """
+    Reduce status events to one target per WhatsApp message id.
+
+    Returns ({wa_id: most advanced of sent/delivered/read}, {wa_ids reported failed}).
+    Events arrive out of order, so a late "delivered" must not beat "read".
+    """
+    progress = {}
+    failed = set()
+    for event in status_events:
+        wa_id = event.get('id')
+        status_str = event.get('status')  # sent, delivered, read, failed
+        if not wa_id:
+            continue
+        if status_str == 'failed':
+            failed.add(wa_id)
+        elif status_str in STATUS_RANK and STATUS_RANK[status_str] > STATUS_RANK.get(progress.get(wa_id), -1):
+            progress[wa_id] = status_str
+    return progress, failed
+
+
+def apply_statuses(status_events):
+    """Apply status events with one guarded UPDATE per target status"""
+    progress, failed = coalesce_statuses(status_events)
+    if not progress and not failed:
+        return 0
+    now = timezone.now()
+    targets = [
+        (target, [wa_id for wa_id, status_str in progress.items() if status_str == target],
+         [s for s, rank in STATUS_RANK.items() if rank < STATUS_RANK[target]])
+        for target in ('sent', 'delivered', 'read')
+    ]
+    # Failed only ends messages that were never delivered; applied after progress
+    targets.append(('failed', list(failed), ['pending', 'sent']))
+
+    changed = []
+    for target, wa_ids, from_statuses in targets:
+        if not wa_ids:
+            continue
+        affected = Message.objects.filter(whatsapp_message_id__in=wa_ids, status__in=from_statuses)
+        rows = list(affected.values_list('id', 'customer_id'))
+        if rows:
+            # Keep the status guard in the UPDATE too, in case another writer got there first
+            affected.filter(id__in=[message_id for message_id, _ in rows]).update(status=target, updated_at=now)
+            changed.extend(rows)
+        logger.info(f"Status {target}: {len(wa_ids)} reported, {len(rows)} advanced")
+    if changed:
+        record_status_changes([message_id for message_id, _ in changed])
+        notify_customers(customer_id for _, customer_id in changed)
+    return len(changed)
+
+
+def media_id_for(msg):
+    msg_type = msg.get('type')
+    if msg_type in MEDIA_MESSAGE_TYPES and msg_type in msg:
+        return msg[msg_type].get('id')
+    return None
+
+
+def store_inbound_messages(inbound):
+    """
+    Store a payload's inbound messages with set-based queries.
+
+    ``inbound`` is a list of (message, contact_names) pairs. Already stored
+    messages are skipped before their media is downloaded; customers are
+    resolved with one IN query plus a bulk insert; messages are bulk inserted.
+    Only the rows this call inserted count towards summaries and blob
+    references, so a redelivery handled by two workers at once is counted once.
+    """
+    parsed = []
+    seen = set()
+    for msg, contact_names in inbound:
+        wa_id = msg.get('id')
+        if not wa_id or wa_id in seen:
+            logger.warning(f"Skipping inbound message without id or repeated in payload: {wa_id}")
+            continue
+        seen.add(wa_id)
+        from_number = msg.get('from')
+        parsed.append((msg, normalize_phone(from_number), contact_names.get(from_number, '')))
+    if not parsed:
+        return []
+
+    # Prevent duplicate messages by whatsapp_message_id (redeliveries are expected)
+    stored = set(Message.objects.filter(whatsapp_message_id__in=seen).values_list('whatsapp_message_id', flat=True))
+    parsed = [item for item in parsed if item[0].get('id') not in stored]
+    if not parsed:
+        return []
+
+    # Media for the whole payload downloads concurrently, before any write
+    media_ids = [media_id_for(msg) for msg, _, _ in parsed if media_id_for(msg)]
+    downloads = download_many(media_ids, get_access_token()) if media_ids else {}
+    # Thumbnails are rendered outside the transaction too; only image files get one
+    previews = {media_id: render_thumbnail(path, mime) for media_id, (path, mime) in downloads.items() if path}
+
+    with serialized_transaction():
+        # Another worker may have stored some of them while media downloaded
+        stored = set(Message.objects.filter(
+            whatsapp_message_id__in=[msg.get('id') for msg, _, _ in parsed]
+        ).values_list('whatsapp_message_id', flat=True))
+        parsed = [item for item in parsed if item[0].get('id') not in stored]
+        if not parsed:
+            return []
+        blobs = register_blobs((path, mime) for path, mime in downloads.values() if path)
+        customers = resolve_customers({phone: name for _, phone, name in parsed})
+        new_messages = []
+        for msg, phone, _ in parsed:
+            media_path, media_type = downloads.get(media_id_for(msg), (None, None))
+            message = Message(
+                customer=customers[phone],
+                content=msg.get('text', {}).get('body', ''),
+                direction='received',
+                status='delivered',
+                whatsapp_message_id=msg.get('id'),
+            )
+            # Save media path if present
+            if media_path:
+                message.media.name = media_path
+                message.media_type = media_type
+                message.media_blob = blobs[media_path]
+                apply_thumbnail(message, previews.get(media_id_for(msg), {}))
+            new_messages.append(message)
+        created = insert_new_messages(new_messages)
+        refresh_ref_counts(message.media_blob_id for message in created)
+        record_messages(created)
+        notify_customers(message.customer_id for message in created)
+    logger.info(f"Stored {len(created)} inbound message(s) for {len(customers)} customer(s)")
+    return created
+
+
+def insert_new_messages(messages):
+    """
+    Bulk insert ``messages`` and return the ones actually inserted, with
+    their pks. If a concurrent worker committed one of them first, the rows
+    are inserted one by one and the duplicates skipped.
+    """
+    try:
+        with transaction.atomic():
+            return Message.objects.bulk_create(messages)
+    except IntegrityError:
+        pass
+    inserted = []
+    for message in messages:
+        try:
+            with transaction.atomic():
+                Message.objects.bulk_create([message])
+        except IntegrityError:
+            logger.info(f"Inbound message {message.whatsapp_message_id} already stored by another worker")
+            continue
+        inserted.append(message)
+    return inserted
+
+
+def resolve_customers(names_by_phone):
+    """Return {phone: Customer}, creating missing customers and filling in profile names"""
+    phones = set(names_by_phone)
+    customers = {c.phone_number: c for c in Customer.objects.filter(phone_number__in=phones)}
+    missing = phones - customers.keys()
+    if missing:
+        Customer.objects.bulk_create(
+            [Customer(phone_number=phone, name=names_by_phone[phone]) for phone in missing],
+            ignore_conflicts=True,
+        )
+        customers.update((c.phone_number, c) for c in Customer.objects.filter(phone_number__in=missing))
+        logger.info(f"Created {len(missing)} customer(s)")
+
+    # Update customer name if we got a profile name and customer has no name or just phone number
+    for phone, customer in customers.items():
+        profile_name = names_by_phone.get(phone)
+        if profile_name and (not customer.name or customer.name == phone or customer.name.startswith('+')):
+            customer.name = profile_name
+            customer.save(update_fields=['name', 'updated_at'])
+            logger.info(f"Updated customer {customer.id} name to: {profile_name}")
+    return customers
@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand
+from whatsapp.archive import (
+    archivable, archive_batch, archive_cutoff, archive_setting, delete_expired_files, expire_media_batch,
+    media_retention_cutoff,
+)
+from whatsapp.media_store import prune_unreferenced
+from whatsapp.models import ArchivedMessage
+
+
+class Command(BaseCommand):
+    help = (
+        'Move messages older than MESSAGE_ARCHIVE_AFTER_DAYS into the archive table in batches, '
+        'then apply MESSAGE_MEDIA_RETENTION_DAYS to archived attachments'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Archive messages older than this (default: MESSAGE_ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--media-days', type=int, help='Delete archived attachments older than this (default: MESSAGE_MEDIA_RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int, help='Messages per transaction (default: MESSAGE_ARCHIVE_BATCH_SIZE)')
+        parser.add_argument('--max-batches', type=int, default=0, help='Stop after this many batches per step (0: until done)')
+        parser.add_argument('--pause', type=float, default=0.1, help='Seconds between batches, leaving the database to live traffic')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be archived')
+
+    def handle(self, *args, **options):
+        cutoff = archive_cutoff(options['days'])
+        media_cutoff = media_retention_cutoff(options['media_days'])
+        batch_size = options['batch_size'] or archive_setting('BATCH_SIZE', 500)
+        if options['dry_run']:
+            self.stdout.write(f"{archivable(cutoff).count()} message(s) older than {cutoff:%Y-%m-%d} would be archived")
+            if media_cutoff:
+                expiring = ArchivedMessage.objects.filter(media__gt='', timestamp__lt=media_cutoff).count()
+                self.stdout.write(f"{expiring} archived attachment(s) older than {media_cutoff:%Y-%m-%d} would be deleted")
+            return
+
+        moved = self.run_batches(lambda: archive_batch(cutoff, batch_size), options)
+        self.stdout.write(f"Archived {moved} message(s) older than {cutoff:%Y-%m-%d}")
+        if media_cutoff:
+            files = 0
+
+            def expire():
+                nonlocal files
+                rows = expire_media_batch(media_cutoff, batch_size)
+                files += delete_expired_files(rows)
+                return len(rows)
+
+            expired = self.run_batches(expire, options)
+            count, _ = prune_unreferenced()
+            self.stdout.write(
+                f"Expired {expired} attachment(s) older than {media_cutoff:%Y-%m-%d}: "
+                f"deleted {files} file(s) and {count} unreferenced blob(s)"
+            )
+        self.stdout.write(self.style.SUCCESS("Done"))
+
+    def run_batches(self, step, options):
+        total = batches = 0
+        while not options['max_batches'] or batches < options['max_batches']:
+            done = step()
+            if not done:
+                break
+            total += done
+            batches += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  batch {batches}: {done} (total {total})")
+            time.sleep(options['pause'])
+        return total
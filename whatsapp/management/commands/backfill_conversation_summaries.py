@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from whatsapp.conversations import backfill_summaries
+from whatsapp.models import Customer
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the conversation summary (sidebar preview and unread count) for every customer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Customers rebuilt per query batch')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        customer_ids = list(Customer.objects.order_by('id').values_list('id', flat=True))
+        written = 0
+        for start in range(0, len(customer_ids), chunk_size):
+            written += backfill_summaries(customer_ids[start:start + chunk_size])
+            self.stdout.write(f"Rebuilt {written}/{len(customer_ids)} summaries")
+        self.stdout.write(self.style.SUCCESS(f"Done: {written} conversation summaries"))
@@ -0,0 +1,152 @@
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+SCHEMA = [
+    "CREATE TABLE message (id INTEGER PRIMARY KEY, customer_id INTEGER, wa_id TEXT UNIQUE, content TEXT, ts REAL, is_read INTEGER)",
+    "CREATE INDEX message_customer_ts ON message (customer_id, ts)",
+    "CREATE TABLE summary (customer_id INTEGER PRIMARY KEY, unread INTEGER, last_at REAL, preview TEXT)",
+]
+
+
+def connect(path, tuned):
+    """Default mode is what Django used before: rollback journal, 5s timeout, deferred BEGIN"""
+    if not tuned:
+        return sqlite3.connect(path, timeout=5, isolation_level=None)
+    options = settings.DATABASES['default'].get('OPTIONS', {})
+    conn = sqlite3.connect(path, timeout=options.get('timeout', 20), isolation_level=None)
+    for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+
+def seed(path, tuned, customers, rows):
+    conn = connect(path, tuned)
+    if not tuned:
+        conn.execute("PRAGMA journal_mode=DELETE")
+    for statement in SCHEMA:
+        conn.execute(statement)
+    now = time.time()
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO message (customer_id, wa_id, content, ts, is_read) VALUES (?, ?, ?, ?, 1)",
+        ((i % customers, f"seed.{i}", f"message {i} " * 8, now - rows + i) for i in range(rows)),
+    )
+    conn.executemany("INSERT INTO summary VALUES (?, 0, ?, '')", ((c, now) for c in range(customers)))
+    conn.execute("COMMIT")
+    conn.close()
+
+
+def summarize(latencies):
+    if not latencies:
+        return 0.0, 0.0
+    latencies.sort()
+    return statistics.median(latencies) * 1000, latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+
+
+def reader(path, tuned, customers, deadline, results):
+    """Dashboard polling: a chat window plus the sidebar summaries"""
+    conn = connect(path, tuned)
+    latencies, errors = [], 0
+    while time.time() < deadline:
+        started = time.perf_counter()
+        try:
+            conn.execute(
+                "SELECT id, content, ts FROM message WHERE customer_id = ? ORDER BY ts DESC LIMIT 50",
+                (random.randrange(customers),),
+            ).fetchall()
+            conn.execute("SELECT customer_id, unread, last_at FROM summary ORDER BY last_at DESC LIMIT 100").fetchall()
+        except sqlite3.OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+    results.put(('read', len(latencies), errors, *summarize(latencies)))
+
+
+def writer(path, tuned, customers, deadline, results, worker):
+    """Webhook ingest: dedupe read, insert, summary update in one transaction"""
+    conn = connect(path, tuned)
+    latencies, errors, n = [], 0, 0
+    while time.time() < deadline:
+        n += 1
+        customer = random.randrange(customers)
+        wa_id = f"w{worker}.{n}"
+        started = time.perf_counter()
+        try:
+            conn.execute("BEGIN IMMEDIATE" if tuned else "BEGIN")
+            conn.execute("SELECT 1 FROM message WHERE wa_id = ?", (wa_id,)).fetchall()
+            conn.execute(
+                "INSERT INTO message (customer_id, wa_id, content, ts, is_read) VALUES (?, ?, 'hello', ?, 0)",
+                (customer, wa_id, time.time()),
+            )
+            conn.execute(
+                "UPDATE summary SET unread = unread + 1, last_at = ?, preview = 'hello' WHERE customer_id = ?",
+                (time.time(), customer),
+            )
+            conn.execute("COMMIT")
+        except sqlite3.OperationalError:
+            errors += 1
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            continue
+        latencies.append(time.perf_counter() - started)
+    results.put(('write', len(latencies), errors, *summarize(latencies)))
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent read/write throughput on a scratch SQLite file with default and tuned settings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4, help='Processes polling like the dashboard')
+        parser.add_argument('--writers', type=int, default=2, help='Processes writing like the webhook worker')
+        parser.add_argument('--duration', type=float, default=5.0, help='Seconds per mode')
+        parser.add_argument('--rows', type=int, default=50000, help='Messages seeded before the run')
+        parser.add_argument('--customers', type=int, default=500)
+
+    def run_mode(self, tuned, options):
+        with tempfile.TemporaryDirectory(prefix='sqlite-bench-') as tmp:
+            path = os.path.join(tmp, 'bench.sqlite3')
+            seed(path, tuned, options['customers'], options['rows'])
+            results = multiprocessing.Queue()
+            deadline = time.time() + options['duration']
+            procs = [
+                multiprocessing.Process(target=reader, args=(path, tuned, options['customers'], deadline, results))
+                for _ in range(options['readers'])
+            ] + [
+                multiprocessing.Process(target=writer, args=(path, tuned, options['customers'], deadline, results, i))
+                for i in range(options['writers'])
+            ]
+            for proc in procs:
+                proc.start()
+            rows = [results.get() for _ in procs]
+            for proc in procs:
+                proc.join()
+        totals = {}
+        for kind, count, errors, p50, p99 in rows:
+            total = totals.setdefault(kind, {'count': 0, 'errors': 0, 'p50': [], 'p99': []})
+            total['count'] += count
+            total['errors'] += errors
+            total['p50'].append(p50)
+            total['p99'].append(p99)
+        return totals
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{options['readers']} reader and {options['writers']} writer processes, "
+            f"{options['duration']:.0f}s per mode, {options['rows']} seeded messages"
+        )
+        # Latencies are the worst process's percentiles; "locked" counts operations that failed
+        self.stdout.write(f"{'mode':<8} {'op':<6} {'ops/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'locked':>7}")
+        for label, tuned in (('default', False), ('tuned', True)):
+            for kind, total in sorted(self.run_mode(tuned, options).items()):
+                self.stdout.write(
+                    f"{label:<8} {kind:<6} {total['count'] / options['duration']:>9.0f} "
+                    f"{max(total['p50']):>8.2f} {max(total['p99']):>8.2f} {total['errors']:>7}"
+                )
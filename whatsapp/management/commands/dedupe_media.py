@@ -0,0 +1,92 @@
+import mimetypes
+import os
+import shutil
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from whatsapp.media_downloader import extension_for
+from whatsapp.media_store import blob_name, blob_path, hash_file, prune_unreferenced, refresh_ref_counts, register_blobs
+from whatsapp.models import ArchivedMessage, MediaBlob, Message
+
+
+def human_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.1f} {unit}" if unit != 'B' else f"{size} B"
+        size /= 1024
+
+
+class Command(BaseCommand):
+    help = 'Move message media into the content-addressed store, dropping duplicate files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be reclaimed')
+        parser.add_argument('--prune', action='store_true', help='Also delete blobs no message references any more')
+        parser.add_argument('--grace-hours', type=int, default=24, help='Minimum age of blobs deleted by --prune')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        # Archived messages point at the same files, so both tables move together
+        legacy = {}
+        for model in (Message, ArchivedMessage):
+            rows = (
+                model.objects.filter(media_blob__isnull=True)
+                .exclude(media='').exclude(media__isnull=True)
+                .values_list('media', 'media_type').distinct()
+            )
+            for name, media_type in rows:
+                if not legacy.get(name):
+                    legacy[name] = media_type
+        known = set(MediaBlob.objects.values_list('sha256', flat=True))
+        files = duplicates = missing = 0
+        reclaimed = 0
+        touched = set()
+        for name, media_type in sorted(legacy.items()):
+            path = blob_path(name)
+            if not os.path.exists(path):
+                missing += 1
+                self.stderr.write(f"Missing file: {name}")
+                continue
+            files += 1
+            size = os.path.getsize(path)
+            sha256 = hash_file(path)
+            is_duplicate = sha256 in known
+            known.add(sha256)
+            if is_duplicate:
+                duplicates += 1
+                reclaimed += size
+            if dry_run:
+                continue
+
+            mime_type = media_type or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            target = blob_name(sha256, os.path.splitext(name)[1].lstrip('.').lower() or extension_for(mime_type))
+            target_path = blob_path(target)
+            if not os.path.exists(target_path) and not MediaBlob.objects.filter(sha256=sha256).exists():
+                # Copy (hard link where possible) so the old name stays valid until the rows move
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                try:
+                    os.link(path, target_path)
+                except OSError:
+                    shutil.copy2(path, target_path)
+            with transaction.atomic():
+                blob = (
+                    MediaBlob.objects.filter(sha256=sha256).first()
+                    or register_blobs([(target, mime_type)])[target]
+                )
+                for model in (Message, ArchivedMessage):
+                    model.objects.filter(media=name, media_blob__isnull=True).update(media=blob.file.name, media_blob=blob)
+            touched.add(blob.id)
+            if os.path.abspath(path) != os.path.abspath(blob_path(blob.file.name)):
+                os.remove(path)
+
+        if not dry_run:
+            refresh_ref_counts(touched)
+        verb = 'Would reclaim' if dry_run else 'Reclaimed'
+        self.stdout.write(
+            f"{files} file(s) checked, {duplicates} duplicate(s), {missing} missing. "
+            f"{verb} {human_size(reclaimed)} ({reclaimed} bytes)"
+        )
+        if options['prune'] and not dry_run:
+            count, freed = prune_unreferenced(options['grace_hours'])
+            self.stdout.write(f"Pruned {count} unreferenced blob(s), {human_size(freed)}")
+        self.stdout.write(self.style.SUCCESS("Done"))
@@ -0,0 +1,87 @@
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+from whatsapp.models import Agent, Customer, Message
+
+# Statements with a plan worth reading; inserts and savepoints are skipped
+EXPLAINED_STATEMENTS = ('SELECT', 'UPDATE', 'DELETE')
+
+
+class Command(BaseCommand):
+    help = 'Print the database query plan (EXPLAIN QUERY PLAN on SQLite) for each dashboard and webhook hot query'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customer-id', type=int, help='Customer to use in per-conversation queries (default: busiest)')
+
+    def hot_queries(self, customer_id, agent_id):
+        """
+        (label, QuerySet or callable) pairs built from the code the app runs.
+        QuerySets are explained as they are; callables are run in a
+        transaction that is rolled back, and every query they send is explained.
+        """
+        from dashboard.stats import compute_stats
+        from dashboard.views import get_message_deltas, get_older_messages, sidebar_customers
+        from whatsapp.conversations import mark_read
+        from whatsapp.ingest import apply_statuses, store_inbound_messages
+
+        newest = Message.objects.filter(customer_id=customer_id).order_by('-id').values_list('id', flat=True).first() or 0
+        since = timezone.now().isoformat()
+        inbound = {'id': f'wamid.explain-{uuid.uuid4().hex}', 'from': '10000000000', 'type': 'text', 'text': {'body': 'explain'}}
+        return [
+            ('Sidebar (admin)', sidebar_customers(Customer.objects.all())),
+            ('Sidebar (agent)', sidebar_customers(Customer.objects.filter(assigned_agent_id=agent_id))),
+            ('Chat window', lambda: get_message_deltas(customer_id)),
+            ('Chat poll', lambda: get_message_deltas(customer_id, after=str(newest), since=since)),
+            ('Load older', lambda: get_older_messages(customer_id, newest)),
+            ('Mark as read', lambda: mark_read(customer_id)),
+            ('Webhook message', lambda: store_inbound_messages([(inbound, {})])),
+            ('Webhook statuses', lambda: apply_statuses([{'id': 'wamid.a', 'status': 'delivered'}, {'id': 'wamid.b', 'status': 'read'}])),
+            ('Home stats (admin)', lambda: compute_stats(Customer.objects.all())),
+            ('Home stats (agent)', lambda: compute_stats(Customer.objects.filter(assigned_agent_id=agent_id))),
+        ]
+
+    def handle(self, *args, **options):
+        customer_id = options['customer_id'] or (
+            Message.objects.values('customer_id').annotate(n=Count('id')).order_by('-n')
+            .values_list('customer_id', flat=True).first() or 0
+        )
+        agent_id = Agent.objects.values_list('id', flat=True).first() or 0
+        self.stdout.write(f"Database: {connection.vendor}, customer_id={customer_id}, agent_id={agent_id}")
+        for label, query in self.hot_queries(customer_id, agent_id):
+            self.stdout.write(self.style.SUCCESS(f"\n=== {label} ==="))
+            if callable(query):
+                for sql, params in self.captured(query):
+                    self.write_plan(sql, self.explain(sql, params))
+            else:
+                self.write_plan(str(query.query), query.explain())
+
+    def captured(self, func):
+        """Run ``func`` without keeping its writes; returns the (sql, params) it executed"""
+        statements = []
+
+        def capture(execute, sql, params, many, context):
+            if not many and sql.lstrip().upper().startswith(EXPLAINED_STATEMENTS):
+                statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with transaction.atomic():
+            with connection.execute_wrapper(capture):
+                func()
+            transaction.set_rollback(True)
+        return statements
+
+    def explain(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+            rows = cursor.fetchall()
+        return '\n'.join(' '.join(str(value) for value in row) for row in rows)
+
+    def write_plan(self, sql, plan):
+        self.stdout.write(sql)
+        self.stdout.write(plan)
+        # SQLite reports "SCAN <table>" (no index) for full table scans
+        if any(' SCAN ' in f' {line.upper()} ' and 'USING' not in line.upper() for line in plan.splitlines()):
+            self.stdout.write(self.style.WARNING("!! full table scan"))
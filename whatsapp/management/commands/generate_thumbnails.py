@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from whatsapp.models import Message
+from whatsapp.thumbnails import apply_thumbnail, render_thumbnail
+
+
+class Command(BaseCommand):
+    help = 'Create thumbnails and placeholders for image messages stored before they were generated at ingest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Messages loaded per query')
+
+    def handle(self, *args, **options):
+        pending = (
+            Message.objects.filter(Q(thumbnail__isnull=True) | Q(thumbnail=''), media_type__startswith='image/')
+            .exclude(media='').exclude(media__isnull=True)
+            .only('id', 'media', 'media_type', 'thumbnail')
+        )
+        done = skipped = 0
+        last_id = 0
+        while True:
+            batch = list(pending.filter(id__gt=last_id).order_by('id')[:options['batch_size']])
+            if not batch:
+                break
+            for message in batch:
+                fields = render_thumbnail(message.media.name, message.media_type)
+                if not fields:
+                    skipped += 1
+                    continue
+                apply_thumbnail(message, fields)
+                message.save(update_fields=[*fields, 'updated_at'])
+                done += 1
+            last_id = batch[-1].id
+            self.stdout.write(f"Thumbnails: {done} created, {skipped} skipped")
+        self.stdout.write(self.style.SUCCESS(f"Done: {done} thumbnails created, {skipped} files skipped"))
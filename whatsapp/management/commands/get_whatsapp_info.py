@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand
+from whatsapp.graph import graph_client
 from whatsapp.whatsapp_api import get_access_token
-import requests
 
 
 class Command(BaseCommand):
@@ -17,15 +17,12 @@ class Command(BaseCommand):
             self.stdout.write(self.style.ERROR("No access token found in database!"))
             return
         
-        headers = {"Authorization": f"Bearer {access_token}"}
-        
         waba_id = options.get('waba_id')
         business_id = options.get('business_id')
         
         if business_id:
             # Get WABAs from business
-            waba_url = f"https://graph.facebook.com/v19.0/{business_id}/owned_whatsapp_business_accounts"
-            response = requests.get(waba_url, headers=headers)
+            response = graph_client.get(f"{business_id}/owned_whatsapp_business_accounts")
             waba_result = response.json()
             self.stdout.write(f"WABAs: {waba_result}")
             
@@ -36,8 +33,7 @@ class Command(BaseCommand):
         
         if waba_id:
             # Get phone numbers from WABA
-            phones_url = f"https://graph.facebook.com/v19.0/{waba_id}/phone_numbers"
-            response = requests.get(phones_url, headers=headers)
+            response = graph_client.get(f"{waba_id}/phone_numbers")
             phones = response.json()
             self.stdout.write(f"\nPhone Numbers Response: {phones}")
             
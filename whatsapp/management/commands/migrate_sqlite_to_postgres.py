@@ -0,0 +1,86 @@
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.models import DateTimeField, Max
+from whatsapp.models import Agent, ArchivedMessage, Customer, MediaBlob, Message, Template, WhatsAppConfig
+
+# Parents before children so foreign keys always resolve. MediaBlob is
+# copied because Message and ArchivedMessage reference it.
+MODELS = [WhatsAppConfig, Agent, Template, Customer, MediaBlob, Message, ArchivedMessage]
+
+
+@contextmanager
+def keep_timestamps(model):
+    """Stop auto_now/auto_now_add from overwriting copied timestamps"""
+    fields = [f for f in model._meta.concrete_fields if isinstance(f, DateTimeField) and (f.auto_now or f.auto_now_add)]
+    saved = [(f, f.auto_now, f.auto_now_add) for f in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy customers, messages (hot and archived), templates, agents and WhatsApp config from the SQLite database '
+        'into PostgreSQL in primary-key chunks; re-running continues after the last copied row'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default='sqlite', help="Database alias to read from (default: 'sqlite')")
+        parser.add_argument('--target', default='default', help="Database alias to write to (default: 'default')")
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows read and inserted per transaction')
+
+    def handle(self, *args, **options):
+        source, target, chunk_size = options['source'], options['target'], options['chunk_size']
+        for alias in (source, target):
+            if alias not in connections.settings:
+                raise CommandError(f"Database alias '{alias}' is not configured (set POSTGRES_DB, see .env.example)")
+        if source == target:
+            raise CommandError("Source and target are the same database")
+        if connections[target].vendor != 'postgresql':
+            self.stderr.write(f"Warning: target '{target}' is {connections[target].vendor}, not PostgreSQL")
+        if Message._meta.db_table not in connections[target].introspection.table_names():
+            raise CommandError(f"The target has no tables yet; run `python manage.py migrate --database {target}` first")
+
+        for model in MODELS:
+            copied = self.copy_model(model, source, target, chunk_size)
+            source_count = model.objects.using(source).count()
+            target_count = model.objects.using(target).count()
+            status = self.style.SUCCESS('ok') if target_count >= source_count else self.style.ERROR('MISSING ROWS')
+            self.stdout.write(
+                f"{model._meta.label}: copied {copied}, source {source_count}, target {target_count} {status}"
+            )
+
+        # Explicit ids were inserted; move the sequences past them
+        sequence_sql = connections[target].ops.sequence_reset_sql(no_style(), MODELS)
+        if sequence_sql:
+            with connections[target].cursor() as cursor:
+                for statement in sequence_sql:
+                    cursor.execute(statement)
+        # Summaries are derived data: rebuild them instead of copying
+        self.stdout.write(self.style.SUCCESS(
+            "Done. Rebuild the chat sidebar with `python manage.py backfill_conversation_summaries` "
+            "and create dashboard logins with `python manage.py createsuperuser`."
+        ))
+
+    def copy_model(self, model, source, target, chunk_size):
+        # Resume after the highest id already in the target
+        last_pk = model.objects.using(target).aggregate(last=Max('pk'))['last'] or 0
+        rows = model.objects.using(source).order_by('pk')
+        copied = 0
+        with keep_timestamps(model):
+            while True:
+                chunk = list(rows.filter(pk__gt=last_pk)[:chunk_size])
+                if not chunk:
+                    return copied
+                with transaction.atomic(using=target):
+                    model.objects.using(target).bulk_create(chunk, batch_size=chunk_size)
+                last_pk = chunk[-1].pk
+                copied += len(chunk)
+                self.stdout.write(f"  {model._meta.label}: {copied} rows (up to id {last_pk})")
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from whatsapp.inbox import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Run the webhook inbox worker: drain stored webhook payloads in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Payloads claimed per batch (default: WEBHOOK_INBOX_BATCH_SIZE)')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when the inbox is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once the inbox is drained')
+
+    def handle(self, *args, **options):
+        self.stdout.write("Processing webhook inbox...")
+        try:
+            run_worker(
+                batch_size=options['batch_size'],
+                poll_interval=options['poll_interval'],
+                once=options['once'],
+            )
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped.")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from whatsapp.search import ensure_fts_triggers, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text message search index (SQLite FTS5) from the message table'
+
+    def handle(self, *args, **options):
+        if ensure_fts_triggers():
+            # Missing triggers are recreated together with a rebuild
+            self.stdout.write("Recreated missing index triggers")
+        elif not rebuild_index():
+            self.stdout.write("No FTS5 index on this database; search uses the LIKE fallback")
+            return
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt"))
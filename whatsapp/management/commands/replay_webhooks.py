@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from whatsapp.inbox import inbox_stats, replay
+from whatsapp.models import InboundWebhook
+
+
+class Command(BaseCommand):
+    help = 'Re-queue failed webhook payloads and show inbox backpressure stats'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help='Inbox ids to replay')
+        parser.add_argument('--all-failed', action='store_true', help='Replay every failed payload')
+        parser.add_argument('--stats', action='store_true', help='Only print inbox stats')
+
+    def handle(self, *args, **options):
+        if not options['stats']:
+            if options['ids']:
+                queryset = InboundWebhook.objects.filter(id__in=options['ids'])
+            elif options['all_failed']:
+                queryset = InboundWebhook.objects.filter(status='failed')
+            else:
+                self.stdout.write(self.style.WARNING(
+                    "\nUsage:\n"
+                    "  python manage.py replay_webhooks ID [ID ...]\n"
+                    "  python manage.py replay_webhooks --all-failed\n"
+                    "  python manage.py replay_webhooks --stats"
+                ))
+                return
+            count = replay(queryset)
+            self.stdout.write(self.style.SUCCESS(f"Re-queued {count} payload(s)"))
+
+        stats = inbox_stats()
+        self.stdout.write(
+            f"Pending: {stats['pending']}  Processing: {stats['processing']}  "
+            f"Failed: {stats['failed']}  Lag: {stats['lag_seconds']:.1f}s"
+        )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from whatsapp.broadcasts import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Run the broadcast worker: send queued template campaigns at the configured rate'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=5.0, help='Seconds to wait when no job is queued')
+        parser.add_argument('--once', action='store_true', help='Exit when no job is left')
+
+    def handle(self, *args, **options):
+        self.stdout.write("Waiting for broadcast jobs...")
+        try:
+            run_worker(poll_interval=options['poll_interval'], once=options['once'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped. Unfinished jobs resume on the next run.")
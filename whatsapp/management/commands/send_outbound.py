@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from whatsapp.outbox import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Run the outbound worker: send queued agent messages, one thread per lane'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lane', type=int, action='append', dest='lanes', help='Lane to serve (repeatable; default: all OUTBOUND_LANES)')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when a lane is idle')
+        parser.add_argument('--once', action='store_true', help='Exit once nothing is due')
+
+    def handle(self, *args, **options):
+        self.stdout.write("Sending outbound messages...")
+        try:
+            run_worker(lanes=options['lanes'], poll_interval=options['poll_interval'], once=options['once'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped. Unsent messages stay queued.")
@@ -1,6 +1,5 @@
 from django.core.management.base import BaseCommand
-from whatsapp.whatsapp_api import get_access_token
-import requests
+from whatsapp.graph import graph_client
 
 
 class Command(BaseCommand):
@@ -10,15 +9,12 @@ class Command(BaseCommand):
         parser.add_argument('--waba-id', type=str, required=True, help='WhatsApp Business Account ID')
 
     def handle(self, *args, **options):
-        access_token = get_access_token()
         waba_id = options['waba_id']
         
-        headers = {"Authorization": f"Bearer {access_token}"}
-        
         # Subscribe the app to the WABA
-        url = f"https://graph.facebook.com/v19.0/{waba_id}/subscribed_apps"
+        path = f"{waba_id}/subscribed_apps"
         
-        response = requests.post(url, headers=headers)
+        response = graph_client.post(path, idempotent=True)
         result = response.json()
         
         if 'success' in result and result['success']:
@@ -28,5 +24,5 @@ class Command(BaseCommand):
         
         # Check current subscriptions
         self.stdout.write("\nChecking current subscriptions...")
-        response = requests.get(url, headers=headers)
+        response = graph_client.get(path)
         self.stdout.write(f"Subscribed apps: {response.json()}")
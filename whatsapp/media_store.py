@@ -0,0 +1,181 @@
+"""
+Content-addressed storage for chat media.
+
+Every file is hashed (SHA-256) while it is streamed to disk and stored once
+under ``blobs/<aa>/<sha256>.<ext>``; a MediaBlob row records its size, MIME
+type and how many messages reference it. Receiving or uploading the same
+PDF again costs a hash, not another copy. Unreferenced blobs are removed by
+``prune_unreferenced`` (``dedupe_media --prune``) after a grace period.
+"""
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import ArchivedMessage, MediaBlob, Message
+
+logger = logging.getLogger("whatsapp.media")
+
+BLOB_DIR = 'blobs'
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+SIGNED_URL_SALT = 'whatsapp.media'
+
+
+def blob_name(sha256, ext):
+    # Two-character fan-out keeps directories small
+    return f"{BLOB_DIR}/{sha256[:2]}/{sha256}.{ext}"
+
+
+def blob_path(name):
+    return os.path.join(settings.MEDIA_ROOT, name)
+
+
+def write_blob(chunks, ext):
+    """
+    Stream ``chunks`` to a temporary file while hashing, then move it to its
+    content address. Returns (name, sha256, size).
+
+    No database access: safe to call from download threads. An exception
+    raised by the chunk iterator (size or time limits) discards the file.
+    """
+    root = blob_path(BLOB_DIR)
+    os.makedirs(root, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=root, prefix='.incoming-', suffix='.part')
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            fd = None
+            for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        sha256 = digest.hexdigest()
+        name = blob_name(sha256, ext)
+        final_path = blob_path(name)
+        if not os.path.exists(final_path):
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(tmp_path, final_path)
+    finally:
+        if fd is not None:
+            os.close(fd)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return name, sha256, size
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def register_blobs(entries):
+    """
+    Ensure a MediaBlob row for each written blob; ``entries`` are
+    (name, mime_type) pairs as returned by write_blob and the downloader.
+    Returns {name: MediaBlob}.
+    """
+    entries = dict(entries)
+    if not entries:
+        return {}
+    sha_by_name = {name: os.path.splitext(os.path.basename(name))[0] for name in entries}
+    MediaBlob.objects.bulk_create(
+        [
+            MediaBlob(sha256=sha_by_name[name], file=name, size=os.path.getsize(blob_path(name)), mime_type=mime or '')
+            for name, mime in entries.items()
+        ],
+        ignore_conflicts=True,
+    )
+    blobs = {blob.sha256: blob for blob in MediaBlob.objects.filter(sha256__in=sha_by_name.values())}
+    result = {}
+    for name, sha256 in sha_by_name.items():
+        blob = blobs[sha256]
+        if blob.file.name != name:
+            # Same bytes already stored under another extension: keep one copy
+            os.remove(blob_path(name))
+            logger.info(f"Dropped {name}: same content as {blob.file.name}")
+        result[name] = blob
+    return result
+
+
+def store_file(file, mime_type, ext):
+    """Store a Django File (e.g. an upload) and return its MediaBlob"""
+    name, _, _ = write_blob(file.chunks(), ext)
+    return register_blobs([(name, mime_type)])[name]
+
+
+def refresh_ref_counts(blob_ids):
+    """Recount references from the Message and ArchivedMessage tables; idempotent, so safe under concurrency"""
+    blob_ids = {blob_id for blob_id in blob_ids if blob_id}
+    if not blob_ids:
+        return
+    counts = [
+        Coalesce(Subquery(
+            model.objects.filter(media_blob=OuterRef('pk'))
+            .order_by().values('media_blob').annotate(n=Count('id')).values('n'),
+            output_field=IntegerField(),
+        ), 0)
+        for model in (Message, ArchivedMessage)
+    ]
+    MediaBlob.objects.filter(id__in=blob_ids).update(ref_count=counts[0] + counts[1])
+
+
+def prune_unreferenced(grace_hours=24):
+    """Delete blobs (and their thumbnails) no message has referenced for ``grace_hours``; returns (count, bytes)"""
+    candidates = MediaBlob.objects.filter(created_at__lt=timezone.now() - timedelta(hours=grace_hours))
+    refresh_ref_counts(candidates.filter(ref_count=0).values_list('id', flat=True))
+    count = freed = 0
+    for blob in candidates.filter(ref_count=0, messages__isnull=True, archived_messages__isnull=True):
+        path = blob_path(blob.file.name)
+        if os.path.exists(path):
+            freed += os.path.getsize(path)
+            os.remove(path)
+        # The thumbnail is named after the content hash (whatsapp.thumbnails)
+        for name in blob_thumbnail_names(blob.sha256):
+            if default_storage.exists(name):
+                freed += default_storage.size(name)
+                default_storage.delete(name)
+        blob.delete()
+        count += 1
+    return count, freed
+
+
+def blob_thumbnail_names(sha256):
+    return [f'chat_thumbs/{sha256}.{ext}' for ext in ('webp', 'jpg')]
+
+
+def blob_sha256(name):
+    """The content hash encoded in a blob or blob-thumbnail name, or None for legacy names"""
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return stem if SHA256_RE.match(stem) else None
+
+
+def signed_media_url(name):
+    """
+    Media URL that works without a dashboard session, for fetchers such as
+    Meta's servers downloading an outbound attachment. Valid for
+    MEDIA_SIGNED_URL_MAX_AGE seconds.
+    """
+    token = signing.dumps(name, salt=SIGNED_URL_SALT, compress=True)
+    return f"{default_storage.url(name)}?{urlencode({'token': token})}"
+
+
+def check_media_token(name, token):
+    max_age = getattr(settings, 'MEDIA_SIGNED_URL_MAX_AGE', 24 * 3600)
+    try:
+        return signing.loads(token, salt=SIGNED_URL_SALT, max_age=max_age) == name
+    except signing.BadSignature:
+        return False
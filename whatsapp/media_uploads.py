@@ -0,0 +1,101 @@
+"""
+Upload-once media ids for outbound attachments.
+
+Sending by ``link`` makes Meta fetch the file from us for every message.
+Instead each blob is uploaded to the Graph ``/media`` endpoint once per
+phone number and the returned id is cached in MediaUpload until shortly
+before it expires (WHATSAPP_MEDIA_ID_TTL; Meta keeps uploads for 30 days).
+An id Meta no longer accepts is dropped and the blob uploaded again.
+"""
+import logging
+import time
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .db import serialized_write
+from .media_store import blob_path
+from .models import MediaUpload
+from .whatsapp_api import WHATSAPP_PHONE_NUMBER_ID, is_retryable_error, response_error, upload_media
+
+logger = logging.getLogger("whatsapp.media")
+
+# Errors meaning the media id itself is unusable (expired, deleted, or the upload failed on Meta's side)
+MEDIA_ID_ERROR_CODES = frozenset({100, 131053})
+
+UPLOAD_LOCK_KEY = 'whatsapp:media-upload:{}'
+UPLOAD_LOCK_TIMEOUT = 120  # seconds; longer than any single upload
+
+
+class MediaUploadError(Exception):
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def cached_media_id(blob):
+    # Keep a margin so an id never expires between lookup and send
+    fresh_until = timezone.now() + timedelta(hours=1)
+    return (
+        MediaUpload.objects.filter(blob=blob, phone_number_id=WHATSAPP_PHONE_NUMBER_ID, expires_at__gt=fresh_until)
+        .values_list('media_id', flat=True).first()
+    )
+
+
+def get_media_id(blob, filename=None, refresh=False):
+    """Return a Graph media id for the blob, uploading it if there is no usable cached one"""
+    if not refresh:
+        media_id = cached_media_id(blob)
+        if media_id:
+            return media_id
+    # One upload per blob at a time across workers: the others wait for its id
+    lock_key = UPLOAD_LOCK_KEY.format(blob.id)
+    deadline = time.monotonic() + UPLOAD_LOCK_TIMEOUT
+    while not cache.add(lock_key, 1, timeout=UPLOAD_LOCK_TIMEOUT):
+        if time.monotonic() > deadline:
+            break
+        time.sleep(0.5)
+        media_id = cached_media_id(blob)
+        if media_id and not refresh:
+            return media_id
+    try:
+        return upload_blob(blob, filename)
+    finally:
+        cache.delete(lock_key)
+
+
+def upload_blob(blob, filename=None):
+    try:
+        api_response = upload_media(blob_path(blob.file.name), blob.mime_type or 'application/octet-stream', filename)
+    except requests.RequestException as exc:
+        # Nothing was sent to the customer yet, so any failure is safe to retry
+        raise MediaUploadError(f"Media upload failed: {type(exc).__name__}: {exc}", retryable=True) from exc
+    media_id = api_response.get('id') if isinstance(api_response, dict) else None
+    if not media_id:
+        code, message = response_error(api_response)
+        raise MediaUploadError(f"Media upload failed: {code}: {message}", retryable=is_retryable_error(api_response))
+    save_media_id(blob, media_id)
+    logger.info(f"Uploaded {blob.file.name} as media {media_id}")
+    return media_id
+
+
+@serialized_write
+def save_media_id(blob, media_id):
+    now = timezone.now()
+    MediaUpload.objects.update_or_create(
+        blob=blob,
+        phone_number_id=WHATSAPP_PHONE_NUMBER_ID,
+        defaults={
+            'media_id': media_id,
+            'uploaded_at': now,
+            'expires_at': now + timedelta(seconds=getattr(settings, 'WHATSAPP_MEDIA_ID_TTL', 29 * 24 * 3600)),
+        },
+    )
+
+
+def is_media_id_error(api_response):
+    code, _ = response_error(api_response)
+    return code in MEDIA_ID_ERROR_CODES
@@ -0,0 +1,199 @@
+"""
+In-process metrics with Prometheus text exposition.
+
+Counters and histograms live in a per-process registry. Every process
+(web workers, process_webhooks, send_outbound, run_broadcasts) publishes a
+snapshot to the shared cache every METRICS_PUBLISH_INTERVAL seconds, and
+``/metrics`` renders all live snapshots labelled by role and pid, plus
+queue gauges read from the database at scrape time. Nothing here talks to
+the network, so recording a sample is a dict update under a lock.
+
+Payload logging goes through ``log_payload``: one JSON line, sampled at
+PAYLOAD_LOG_SAMPLE_RATE (always for errors), serialized only when it is
+actually written.
+"""
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger("whatsapp.metrics")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# name -> (type, help, buckets)
+METRICS = {
+    'http_request_duration_seconds': ('histogram', 'Request latency by view, method and status class', LATENCY_BUCKETS),
+    'http_request_db_queries': ('histogram', 'SQL queries per request by view', QUERY_COUNT_BUCKETS),
+    'http_request_db_seconds': ('histogram', 'Time spent in SQL per request by view', LATENCY_BUCKETS),
+    'graph_request_duration_seconds': ('histogram', 'Graph API call latency by endpoint and HTTP status', LATENCY_BUCKETS),
+    'graph_errors_total': ('counter', 'Graph API error responses by endpoint and error code', None),
+    'webhook_received_total': ('counter', 'Webhook payloads accepted into the inbox', None),
+    'inbox_batch_duration_seconds': ('histogram', 'Time to apply one inbox batch', LATENCY_BUCKETS),
+    'inbox_processed_total': ('counter', 'Inbox payloads handled by result', None),
+    'outbox_sends_total': ('counter', 'Outbound queue send attempts by result', None),
+    'send_rate_wait_seconds': ('histogram', 'Wait for a send slot by rate limit scope and priority', LATENCY_BUCKETS),
+    'send_rate_limited_total': ('counter', 'Sends given up for lack of a slot within their maximum wait', None),
+    'send_throttled_total': ('counter', 'Sends Meta rejected for throughput (130429) or pair rate (131056)', None),
+}
+PREFIX = 'whatsapp_'
+SNAPSHOT_KEY = 'metrics:process:{}'
+INDEX_KEY = 'metrics:processes'
+
+
+def metrics_setting(name, default):
+    return getattr(settings, f'METRICS_{name}', default)
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def key(self, name, labels):
+        return name, tuple(sorted((label, str(value)) for label, value in (labels or {}).items()))
+
+    def inc(self, name, labels=None, value=1):
+        key = self.key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        buckets = METRICS[name][2]
+        key = self.key(name, labels)
+        with self._lock:
+            series = self.histograms.get(key)
+            if series is None:
+                # Per-bucket (not cumulative) counts, then +Inf, sum
+                series = self.histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            series[bisect_left(buckets, value)] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': {key: list(series) for key, series in self.histograms.items()},
+            }
+
+
+registry = Registry()
+_process = {'role': 'web', 'published_at': 0.0}
+
+
+def set_role(role):
+    """Name this process in published snapshots (workers call it at startup)"""
+    _process['role'] = role
+
+
+def process_id():
+    return f"{_process['role']}:{socket.gethostname()}:{os.getpid()}"
+
+
+def publish_due():
+    return time.monotonic() - _process['published_at'] >= metrics_setting('PUBLISH_INTERVAL', 15)
+
+
+def publish(force=False):
+    """Write this process's snapshot to the shared cache, at most every METRICS_PUBLISH_INTERVAL"""
+    interval = metrics_setting('PUBLISH_INTERVAL', 15)
+    if not force and not publish_due():
+        return
+    _process['published_at'] = time.monotonic()
+    key = SNAPSHOT_KEY.format(process_id())
+    try:
+        cache.set(key, {'role': _process['role'], 'pid': os.getpid(), **registry.snapshot()}, timeout=interval * 4)
+        index = cache.get(INDEX_KEY) or []
+        if key not in index:
+            # Racy read-modify-write, but every publish re-checks, so a lost entry comes back
+            cache.set(INDEX_KEY, [k for k in index if cache.get(k) is not None] + [key], timeout=None)
+    except Exception:
+        logger.exception("Publishing metrics failed")
+
+
+def collect_snapshots():
+    publish(force=True)
+    snapshots = []
+    for key in cache.get(INDEX_KEY) or []:
+        snapshot = cache.get(key)
+        if snapshot is not None:
+            snapshots.append(snapshot)
+    return snapshots
+
+
+def label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{label_value(value)}"' for name, value in labels) + '}'
+
+
+def queue_gauges():
+    """Depth and lag of the database-backed queues, read at scrape time"""
+    from .inbox import inbox_stats
+    from .outbox import outbox_stats
+
+    gauges = []
+    for queue, stats in (('inbox', inbox_stats()), ('outbox', outbox_stats())):
+        for status in ('pending', 'processing', 'failed'):
+            gauges.append((f'{queue}_depth', (('status', status),), stats[status]))
+        gauges.append((f'{queue}_lag_seconds', (), stats['lag_seconds']))
+    return gauges
+
+
+def render(snapshots=None, gauges=None):
+    """Prometheus text format (version 0.0.4)"""
+    snapshots = collect_snapshots() if snapshots is None else snapshots
+    gauges = queue_gauges() if gauges is None else gauges
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f"# HELP {PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+        for snapshot in snapshots:
+            process = (('pid', snapshot['pid']), ('role', snapshot['role']))
+            if kind == 'counter':
+                for (metric, labels), value in sorted(snapshot['counters'].items()):
+                    if metric == name:
+                        lines.append(f"{PREFIX}{name}{format_labels(labels + process)} {value}")
+                continue
+            for (metric, labels), series in sorted(snapshot['histograms'].items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), series[:-1]):
+                    cumulative += count
+                    lines.append(f"{PREFIX}{name}_bucket{format_labels(labels + process + (('le', bound),))} {cumulative}")
+                lines.append(f"{PREFIX}{name}_sum{format_labels(labels + process)} {series[-1]}")
+                lines.append(f"{PREFIX}{name}_count{format_labels(labels + process)} {cumulative}")
+    seen = set()
+    for name, labels, value in gauges:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# TYPE {PREFIX}{name} gauge")
+        lines.append(f"{PREFIX}{name}{format_labels(labels)} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def log_payload(log, event, payload, error=False, **fields):
+    """
+    Log ``payload`` as one structured JSON line for a sample of calls
+    (PAYLOAD_LOG_SAMPLE_RATE; errors always). The payload is only
+    serialized when the line is actually written.
+    """
+    if not log.isEnabledFor(logging.INFO):
+        return
+    if not error and random.random() >= getattr(settings, 'PAYLOAD_LOG_SAMPLE_RATE', 0.01):
+        return
+    log.info(json.dumps({'event': event, **fields, 'payload': payload}, default=str, separators=(',', ':')))
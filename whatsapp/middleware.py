@@ -0,0 +1,93 @@
+import contextvars
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+from .metrics import publish, publish_due, registry
+
+# Tracker of the request being handled. A context variable rather than a
+# per-connection wrapper set up around the view: under ASGI sync views run
+# in a worker thread with its own connection, and asgiref carries the
+# context variables over to that thread.
+_current_tracker = contextvars.ContextVar('request_query_tracker', default=None)
+
+
+class QueryTracker:
+    """Counts statements and their time"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+def track_query(execute, sql, params, many, context):
+    """execute_wrapper on every connection (see signals.install_query_tracking)"""
+    tracker = _current_tracker.get()
+    if tracker is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        tracker.count += 1
+        tracker.seconds += time.perf_counter() - started
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unmatched>'
+    return match.view_name or match.route
+
+
+class RequestMetricsMiddleware:
+    """
+    Per-view request latency, SQL query count and SQL time (see
+    whatsapp.metrics), for WSGI and ASGI alike. Streaming responses are
+    timed to their headers; queries made while the body streams (chat_stream)
+    are not counted.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        tracker = QueryTracker()
+        token = _current_tracker.set(tracker)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_tracker.reset(token)
+        self.record(request, response, time.perf_counter() - started, tracker)
+        publish()
+        return response
+
+    async def __acall__(self, request):
+        tracker = QueryTracker()
+        token = _current_tracker.set(tracker)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_tracker.reset(token)
+        self.record(request, response, time.perf_counter() - started, tracker)
+        if publish_due():
+            # The cache write would block the event loop; run it in a thread
+            await sync_to_async(publish, thread_sensitive=False)()
+        return response
+
+    def record(self, request, response, elapsed, tracker):
+        view = view_label(request)
+        registry.observe('http_request_duration_seconds', elapsed, {
+            'view': view, 'method': request.method, 'status': f"{response.status_code // 100}xx",
+        })
+        registry.observe('http_request_db_queries', tracker.count, {'view': view})
+        registry.observe('http_request_db_seconds', tracker.seconds, {'view': view})
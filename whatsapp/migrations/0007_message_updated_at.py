@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp', '0006_customer_assigned_agent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, help_text='Last time the message row changed (e.g. status tick)'),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp', '0008_inboundwebhook'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationSummary',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='conversation_summary', serialize=False, to='whatsapp.customer')),
+                ('last_message_at', models.DateTimeField(blank=True, null=True)),
+                ('last_direction', models.CharField(blank=True, default='', max_length=10)),
+                ('last_status', models.CharField(blank=True, default='', max_length=10)),
+                ('preview', models.CharField(blank=True, default='', help_text='Sidebar preview of the last message', max_length=64)),
+                ('media_kind', models.CharField(blank=True, default='', help_text="'image', 'file' or empty", max_length=10)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='whatsapp.message')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-last_message_at'], name='summary_last_message_at_idx')],
+            },
+        ),
+    ]
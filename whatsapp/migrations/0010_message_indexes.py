@@ -0,0 +1,44 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:24
+
+from django.db import migrations, models
+
+
+def dedupe_whatsapp_message_ids(apps, schema_editor):
+    """Blank ids become NULL; later duplicates of an id lose it so the unique constraint can be added"""
+    Message = apps.get_model('whatsapp', 'Message')
+    Message.objects.filter(whatsapp_message_id='').update(whatsapp_message_id=None)
+    seen = set()
+    duplicates = []
+    rows = Message.objects.exclude(whatsapp_message_id=None).order_by('id').values_list('id', 'whatsapp_message_id')
+    for message_id, wa_id in rows.iterator():
+        if wa_id in seen:
+            duplicates.append(message_id)
+        seen.add(wa_id)
+    Message.objects.filter(id__in=duplicates).update(whatsapp_message_id=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp', '0009_conversationsummary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['customer', 'timestamp'], name='message_customer_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['customer', 'updated_at'], name='message_customer_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('direction', 'received'), ('is_read', False)), fields=['customer'], name='message_unread_idx'),
+        ),
+        migrations.RunPython(dedupe_whatsapp_message_ids, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(condition=models.Q(('whatsapp_message_id__isnull', False)), fields=('whatsapp_message_id',), name='unique_whatsapp_message_id'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp', '0012_outbound_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationsummary',
+            name='last_read_id',
+            field=models.BigIntegerField(blank=True, help_text='Newest inbound message id already marked read (read watermark)', null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp', '0013_summary_read_watermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='media_height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='media_width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='placeholder',
+            field=models.TextField(blank=True, default='', help_text='Tiny blurred data URI shown while the thumbnail loads'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='thumbnail',
+            field=models.FileField(blank=True, help_text='Downscaled preview of an image attachment', null=True, upload_to='chat_thumbs/'),
+        ),
+    ]
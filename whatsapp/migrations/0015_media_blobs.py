@@ -0,0 +1,31 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp', '0014_message_thumbnails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(max_length=200, upload_to='blobs/')),
+                ('size', models.PositiveBigIntegerField()),
+                ('mime_type', models.CharField(blank=True, default='', max_length=100)),
+                ('ref_count', models.PositiveIntegerField(default=0, help_text='Messages using this file; unreferenced blobs are pruned by dedupe_media')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='media_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='messages', to='whatsapp.mediablob'),
+        ),
+    ]
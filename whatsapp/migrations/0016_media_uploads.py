@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:38
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp', '0015_media_blobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone_number_id', models.CharField(max_length=32)),
+                ('media_id', models.CharField(max_length=64)),
+                ('uploaded_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField()),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to='whatsapp.mediablob')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('blob', 'phone_number_id'), name='unique_media_upload')],
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:52
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp', '0017_message_search'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mediablob',
+            name='ref_count',
+            field=models.PositiveIntegerField(default=0, help_text='Messages (hot or archived) using this file; unreferenced blobs are pruned by dedupe_media'),
+        ),
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.BigIntegerField(help_text='Id the message had in the Message table', primary_key=True, serialize=False)),
+                ('content', models.TextField(blank=True)),
+                ('media', models.FileField(blank=True, null=True, upload_to='chat_media/')),
+                ('media_type', models.CharField(blank=True, max_length=100, null=True)),
+                ('thumbnail', models.FileField(blank=True, null=True, upload_to='chat_thumbs/')),
+                ('placeholder', models.TextField(blank=True, default='')),
+                ('media_width', models.PositiveIntegerField(blank=True, null=True)),
+                ('media_height', models.PositiveIntegerField(blank=True, null=True)),
+                ('direction', models.CharField(choices=[('sent', 'Sent'), ('received', 'Received')], max_length=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('delivered', 'Delivered'), ('read', 'Read'), ('failed', 'Failed')], max_length=10)),
+                ('timestamp', models.DateTimeField()),
+                ('whatsapp_message_id', models.CharField(blank=True, max_length=100, null=True)),
+                ('is_read', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('media_expired', models.BooleanField(default=False, help_text='Attachment deleted under MESSAGE_MEDIA_RETENTION_DAYS')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to='whatsapp.customer')),
+                ('media_blob', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_messages', to='whatsapp.mediablob')),
+                ('template', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='whatsapp.template')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['customer', 'timestamp'], name='archived_customer_time_idx'), models.Index(condition=models.Q(('media__gt', '')), fields=['timestamp'], name='archived_media_time_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp', '0018_message_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SendRateBucket',
+            fields=[
+                ('key', models.CharField(help_text="'number:<phone number id>' or 'pair:<phone number id>:<recipient>'", max_length=120, primary_key=True, serialize=False)),
+                ('tat', models.FloatField(default=0, help_text='Epoch seconds at which the bucket is full again')),
+            ],
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.8 on 2026-10-18 21:05
+
+from django.db import migrations
+from django.db.models import Count, OuterRef, Subquery
+
+CHUNK_SIZE = 500
+PREVIEW_LENGTH = 30
+
+
+def build_preview(content, media, media_type):
+    """Frozen copy of whatsapp.conversations.build_preview as of this migration"""
+    content = content or ''
+    preview = content[:PREVIEW_LENGTH] + '...' if len(content) > PREVIEW_LENGTH else content
+    media_kind = ''
+    if media:
+        media_kind = 'image' if 'image' in (media_type or '') else 'file'
+        if not content:
+            preview = '📷 Photo' if media_kind == 'image' else '📎 File'
+    return preview, media_kind
+
+
+def backfill_summaries(apps, schema_editor):
+    """Rebuild every customer's summary from both the hot and the archived messages"""
+    Customer = apps.get_model('whatsapp', 'Customer')
+    Message = apps.get_model('whatsapp', 'Message')
+    ArchivedMessage = apps.get_model('whatsapp', 'ArchivedMessage')
+    ConversationSummary = apps.get_model('whatsapp', 'ConversationSummary')
+
+    def newest(model):
+        return Subquery(model.objects.filter(customer_id=OuterRef('pk')).order_by('-timestamp', '-id').values('id')[:1])
+
+    def unread(model):
+        return Subquery(
+            model.objects.filter(customer_id=OuterRef('pk'), direction='received', is_read=False)
+            .order_by().values('customer_id').annotate(n=Count('id')).values('n')
+        )
+
+    customer_ids = list(Customer.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(customer_ids), CHUNK_SIZE):
+        rows = list(
+            Customer.objects.filter(id__in=customer_ids[start:start + CHUNK_SIZE])
+            .annotate(
+                hot_id=newest(Message), archived_id=newest(ArchivedMessage),
+                hot_unread=unread(Message), archived_unread=unread(ArchivedMessage),
+            )
+            .values_list('id', 'hot_id', 'archived_id', 'hot_unread', 'archived_unread')
+        )
+        hot = Message.objects.in_bulk([row[1] for row in rows if row[1]])
+        archived = ArchivedMessage.objects.in_bulk([row[2] for row in rows if row[2]])
+        summaries = []
+        for customer_id, hot_id, archived_id, hot_unread, archived_unread in rows:
+            summary = ConversationSummary(customer_id=customer_id, unread_count=(hot_unread or 0) + (archived_unread or 0))
+            candidates = [message for message in (hot.get(hot_id), archived.get(archived_id)) if message]
+            if candidates:
+                message = max(candidates, key=lambda m: (m.timestamp, m.id))
+                # The foreign key only points into the hot table
+                summary.last_message_id = message.id if message is hot.get(hot_id) else None
+                summary.last_message_at = message.timestamp
+                summary.last_direction = message.direction
+                summary.last_status = message.status
+                summary.preview, summary.media_kind = build_preview(message.content, message.media, message.media_type)
+            summaries.append(summary)
+        ConversationSummary.objects.bulk_create(
+            summaries,
+            update_conflicts=True,
+            unique_fields=['customer'],
+            update_fields=['last_message', 'last_message_at', 'last_direction', 'last_status', 'preview', 'media_kind', 'unread_count'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('whatsapp', '0019_send_rate_buckets'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,7 @@
 
 from django.db import models
 from django.contrib.auth.hashers import make_password, check_password
+from django.utils import timezone
 
 
 class Agent(models.Model):
@@ -77,6 +78,36 @@ class Template(models.Model):
 		return self.name
 
 
+class MediaBlob(models.Model):
+	"""One stored file, addressed by its SHA-256; shared by every message with the same content"""
+	sha256 = models.CharField(max_length=64, unique=True)
+	file = models.FileField(upload_to='blobs/', max_length=200)
+	size = models.PositiveBigIntegerField()
+	mime_type = models.CharField(max_length=100, blank=True, default='')
+	ref_count = models.PositiveIntegerField(default=0, help_text="Messages (hot or archived) using this file; unreferenced blobs are pruned by dedupe_media")
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	def __str__(self):
+		return f"{self.file.name} ({self.ref_count} refs)"
+
+
+class MediaUpload(models.Model):
+	"""Graph API media id of a blob uploaded for one phone number; reused by sends until it expires"""
+	blob = models.ForeignKey(MediaBlob, on_delete=models.CASCADE, related_name='uploads')
+	phone_number_id = models.CharField(max_length=32)
+	media_id = models.CharField(max_length=64)
+	uploaded_at = models.DateTimeField(default=timezone.now)
+	expires_at = models.DateTimeField()
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=['blob', 'phone_number_id'], name='unique_media_upload'),
+		]
+
+	def __str__(self):
+		return f"{self.media_id} for {self.blob.sha256[:12]} (expires {self.expires_at:%Y-%m-%d})"
+
+
 class Message(models.Model):
 	DIRECTION_CHOICES = (
 		('sent', 'Sent'),
@@ -94,11 +125,239 @@ class Message(models.Model):
 	content = models.TextField(blank=True)
 	media = models.FileField(upload_to='chat_media/', blank=True, null=True)
 	media_type = models.CharField(max_length=100, blank=True, null=True, help_text="MIME type of the media file")
+	media_blob = models.ForeignKey(MediaBlob, on_delete=models.SET_NULL, null=True, blank=True, related_name='messages')
+	thumbnail = models.FileField(upload_to='chat_thumbs/', blank=True, null=True, help_text="Downscaled preview of an image attachment")
+	placeholder = models.TextField(blank=True, default='', help_text="Tiny blurred data URI shown while the thumbnail loads")
+	media_width = models.PositiveIntegerField(blank=True, null=True)
+	media_height = models.PositiveIntegerField(blank=True, null=True)
 	direction = models.CharField(max_length=10, choices=DIRECTION_CHOICES)
 	status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
 	timestamp = models.DateTimeField(auto_now_add=True)
 	whatsapp_message_id = models.CharField(max_length=100, blank=True, null=True)
 	is_read = models.BooleanField(default=False, help_text="Whether message has been read in dashboard")
+	updated_at = models.DateTimeField(auto_now=True, help_text="Last time the message row changed (e.g. status tick)")
+
+	class Meta:
+		indexes = [
+			# Chat history and last-message lookups
+			models.Index(fields=['customer', 'timestamp'], name='message_customer_time_idx'),
+			# Incremental polling: status changes since the previous poll
+			models.Index(fields=['customer', 'updated_at'], name='message_customer_updated_idx'),
+			# Unread counts and read marking only ever touch unread inbound rows
+			models.Index(
+				fields=['customer'],
+				name='message_unread_idx',
+				condition=models.Q(direction='received', is_read=False),
+			),
+		]
+		constraints = [
+			# Webhook dedupe and status updates look messages up by WhatsApp id
+			models.UniqueConstraint(
+				fields=['whatsapp_message_id'],
+				name='unique_whatsapp_message_id',
+				condition=models.Q(whatsapp_message_id__isnull=False),
+			),
+		]
+
+	def __str__(self):
+		return f"{self.direction.title()} to {self.customer.phone_number} at {self.timestamp}"
+
+	def save(self, *args, **kwargs):
+		# Blank ids would collide under the unique constraint; store them as NULL
+		if self.whatsapp_message_id == '':
+			self.whatsapp_message_id = None
+		super().save(*args, **kwargs)
+
+
+class ArchivedMessage(models.Model):
+	"""
+	A Message moved out of the hot table by ``archive_messages`` once it is
+	older than MESSAGE_ARCHIVE_AFTER_DAYS. Keeps the original id, so chat
+	paging continues into the archive with the same cursors.
+	"""
+	id = models.BigIntegerField(primary_key=True, help_text="Id the message had in the Message table")
+	customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='archived_messages')
+	template = models.ForeignKey(Template, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+	content = models.TextField(blank=True)
+	media = models.FileField(upload_to='chat_media/', blank=True, null=True)
+	media_type = models.CharField(max_length=100, blank=True, null=True)
+	media_blob = models.ForeignKey(MediaBlob, on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_messages')
+	thumbnail = models.FileField(upload_to='chat_thumbs/', blank=True, null=True)
+	placeholder = models.TextField(blank=True, default='')
+	media_width = models.PositiveIntegerField(blank=True, null=True)
+	media_height = models.PositiveIntegerField(blank=True, null=True)
+	direction = models.CharField(max_length=10, choices=Message.DIRECTION_CHOICES)
+	status = models.CharField(max_length=10, choices=Message.STATUS_CHOICES)
+	timestamp = models.DateTimeField()
+	whatsapp_message_id = models.CharField(max_length=100, blank=True, null=True)
+	is_read = models.BooleanField(default=True)
+	updated_at = models.DateTimeField()
+	archived_at = models.DateTimeField(default=timezone.now)
+	media_expired = models.BooleanField(default=False, help_text="Attachment deleted under MESSAGE_MEDIA_RETENTION_DAYS")
+
+	class Meta:
+		indexes = [
+			# "Load older" pages read one customer's history in time order
+			models.Index(fields=['customer', 'timestamp'], name='archived_customer_time_idx'),
+			# Media retention only looks at rows that still have an attachment
+			models.Index(fields=['timestamp'], name='archived_media_time_idx', condition=models.Q(media__gt='')),
+		]
+
+	def __str__(self):
+		return f"Archived {self.direction} message #{self.pk} at {self.timestamp}"
+
+
+class InboundWebhook(models.Model):
+	"""Raw webhook payload waiting for (or done with) background processing"""
+	STATUS_CHOICES = (
+		('pending', 'Pending'),
+		('processing', 'Processing'),
+		('processed', 'Processed'),
+		('failed', 'Failed'),
+	)
+	payload = models.JSONField()
+	status = models.CharField(max_length=12, choices=STATUS_CHOICES, default='pending')
+	attempts = models.PositiveIntegerField(default=0)
+	last_error = models.TextField(blank=True, default='')
+	received_at = models.DateTimeField(auto_now_add=True)
+	available_at = models.DateTimeField(default=timezone.now, help_text="Not retried before this time")
+	locked_at = models.DateTimeField(blank=True, null=True)
+	locked_by = models.CharField(max_length=64, blank=True, default='')
+	processed_at = models.DateTimeField(blank=True, null=True)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['status', 'available_at'], name='inbox_status_available_idx'),
+		]
+
+	def __str__(self):
+		return f"Webhook #{self.pk} ({self.status})"
+
+
+class ConversationSummary(models.Model):
+	"""Denormalized sidebar row per customer, kept in sync by whatsapp.conversations"""
+	customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name='conversation_summary')
+	last_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+	last_message_at = models.DateTimeField(blank=True, null=True)
+	last_direction = models.CharField(max_length=10, blank=True, default='')
+	last_status = models.CharField(max_length=10, blank=True, default='')
+	preview = models.CharField(max_length=64, blank=True, default='', help_text="Sidebar preview of the last message")
+	media_kind = models.CharField(max_length=10, blank=True, default='', help_text="'image', 'file' or empty")
+	unread_count = models.PositiveIntegerField(default=0)
+	last_read_id = models.BigIntegerField(blank=True, null=True, help_text="Newest inbound message id already marked read (read watermark)")
+	updated_at = models.DateTimeField(auto_now=True)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['-last_message_at'], name='summary_last_message_at_idx'),
+		]
+
+	def __str__(self):
+		return f"Conversation with {self.customer_id} ({self.unread_count} unread)"
+
+
+class BroadcastJob(models.Model):
+	"""A template campaign; sent by the run_broadcasts worker, one BroadcastRecipient per customer"""
+	STATUS_CHOICES = (
+		('queued', 'Queued'),
+		('running', 'Running'),
+		('completed', 'Completed'),
+		('cancelled', 'Cancelled'),
+	)
+	template = models.ForeignKey(Template, on_delete=models.SET_NULL, null=True, blank=True)
+	template_name = models.CharField(max_length=100)
+	status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+	rate_per_second = models.FloatField(default=20, help_text="Maximum sends per second")
+	concurrency = models.PositiveSmallIntegerField(default=4, help_text="Parallel Graph API requests")
+	total = models.PositiveIntegerField(default=0)
+	sent_count = models.PositiveIntegerField(default=0)
+	failed_count = models.PositiveIntegerField(default=0)
+	created_at = models.DateTimeField(auto_now_add=True)
+	started_at = models.DateTimeField(blank=True, null=True)
+	finished_at = models.DateTimeField(blank=True, null=True)
+	heartbeat_at = models.DateTimeField(blank=True, null=True, help_text="Last progress report from the worker")
+
+	def __str__(self):
+		return f"Broadcast #{self.pk}: {self.template_name} ({self.status})"
+
+	def progress(self):
+		done = self.sent_count + self.failed_count
+		return f"{done}/{self.total} ({done * 100 // self.total if self.total else 100}%)"
+
+	def throughput(self):
+		"""Average sends per second since the job started"""
+		if not self.started_at:
+			return 0.0
+		elapsed = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+		return round((self.sent_count + self.failed_count) / elapsed, 1) if elapsed > 0 else 0.0
+
+
+class BroadcastRecipient(models.Model):
+	STATUS_CHOICES = (
+		('pending', 'Pending'),
+		('sent', 'Sent'),
+		('failed', 'Failed'),
+	)
+	job = models.ForeignKey(BroadcastJob, on_delete=models.CASCADE, related_name='recipients')
+	customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='broadcast_deliveries')
+	phone_number = models.CharField(max_length=20)
+	status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+	attempts = models.PositiveSmallIntegerField(default=0)
+	whatsapp_message_id = models.CharField(max_length=100, blank=True, null=True)
+	error = models.TextField(blank=True, default='')
+	sent_at = models.DateTimeField(blank=True, null=True)
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=['job', 'customer'], name='unique_broadcast_recipient'),
+		]
+		indexes = [
+			models.Index(fields=['job', 'status'], name='broadcast_recipient_status_idx'),
+		]
+
+	def __str__(self):
+		return f"{self.phone_number} in broadcast #{self.job_id} ({self.status})"
+
+
+class OutboundMessage(models.Model):
+	"""Queued Graph API send for an agent-written Message, drained by whatsapp.outbox"""
+	STATUS_CHOICES = (
+		('pending', 'Pending'),
+		('processing', 'Processing'),
+		('sent', 'Sent'),
+		('failed', 'Failed'),
+	)
+	message = models.OneToOneField(Message, on_delete=models.CASCADE, related_name='outbound')
+	customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='outbound_messages')
+	lane = models.PositiveSmallIntegerField(help_text="Worker lane; all sends of a customer share one lane")
+	payload = models.JSONField(help_text="What to send: type plus text, template name or media link")
+	status = models.CharField(max_length=12, choices=STATUS_CHOICES, default='pending')
+	attempts = models.PositiveSmallIntegerField(default=0)
+	last_error = models.TextField(blank=True, default='')
+	created_at = models.DateTimeField(auto_now_add=True)
+	available_at = models.DateTimeField(default=timezone.now, help_text="Not retried before this time")
+	locked_at = models.DateTimeField(blank=True, null=True)
+	locked_by = models.CharField(max_length=64, blank=True, default='')
+	sent_at = models.DateTimeField(blank=True, null=True)
+
+	class Meta:
+		indexes = [
+			# Lane workers scan unfinished sends of their lane in queue order
+			models.Index(
+				fields=['lane', 'id'],
+				name='outbound_open_lane_idx',
+				condition=models.Q(status__in=['pending', 'processing']),
+			),
+		]
+
+	def __str__(self):
+		return f"Outbound #{self.pk} for message #{self.message_id} ({self.status})"
+
+
+class SendRateBucket(models.Model):
+	"""Shared token bucket for Graph API sends (whatsapp.ratelimit); GCRA keeps only the theoretical arrival time"""
+	key = models.CharField(max_length=120, primary_key=True, help_text="'number:<phone number id>' or 'pair:<phone number id>:<recipient>'")
+	tat = models.FloatField(default=0, help_text="Epoch seconds at which the bucket is full again")
 
 	def __str__(self):
-		return f"{self.direction.title()} to {self.customer.phone_number} at {self.timestamp}" 
+		return self.key
@@ -0,0 +1,284 @@
+"""
+Durable outbound queue for agent-written messages.
+
+Views save the Message and an OutboundMessage row in one transaction and
+return; the ``send_outbound`` worker performs the Graph API calls. Every
+customer maps to one lane and a lane only ever sends the oldest unfinished
+row of a conversation, so messages go out in order per conversation while
+lanes run in parallel across conversations. Failed sends are retried with
+exponential backoff; when the retry budget runs out the Message is marked
+``failed`` so the agent sees it.
+"""
+import logging
+import threading
+import traceback
+import uuid
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, connection, transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from .conversations import record_status_changes
+from .db import serialized_transaction, serialized_write
+from .events import notify_customer
+from .graph import never_sent
+from .media_uploads import MediaUploadError, get_media_id, is_media_id_error
+from .metrics import publish, registry, set_role
+from .models import MediaBlob, Message, OutboundMessage
+from .ratelimit import RateLimited
+from .whatsapp_api import (
+    extract_message_id, get_access_token, is_retryable_error, response_error,
+    send_whatsapp_media, send_whatsapp_message,
+)
+
+logger = logging.getLogger("whatsapp.outbox")
+
+OPEN_STATUSES = ('pending', 'processing')
+RATE_LIMIT_MAX_WAIT = 2  # seconds a lane waits for a send slot before rescheduling the row
+
+
+def outbox_setting(name, default):
+    return getattr(settings, f'OUTBOUND_{name}', default)
+
+
+def lane_for(customer_id):
+    return customer_id % outbox_setting('LANES', 4)
+
+
+def enqueue_message(message, payload):
+    """
+    Queue a Message for sending. ``payload`` is one of
+    {'type': 'text', 'text': ...}, {'type': 'template', 'template_name': ...} or
+    {'type': 'media', 'media_url': ..., 'media_type': ..., 'caption': ...,
+    'blob_id': ..., 'filename': ...}; media with a blob is sent by uploaded
+    media id (see whatsapp.media_uploads), ``media_url`` is the fallback.
+    """
+    return OutboundMessage.objects.create(
+        message=message,
+        customer_id=message.customer_id,
+        lane=lane_for(message.customer_id),
+        payload=payload,
+    )
+
+
+@serialized_write
+def claim_heads(lane, visibility_timeout=None):
+    """
+    Claim the oldest unfinished send of each conversation in a lane.
+
+    A conversation whose head is in backoff or being sent elsewhere is
+    skipped entirely, so a later message can never overtake an earlier one.
+    """
+    visibility_timeout = visibility_timeout or outbox_setting('VISIBILITY_TIMEOUT', 120)
+    now = timezone.now()
+    claimable = (
+        Q(status='pending', available_at__lte=now)
+        | Q(status='processing', locked_at__lt=now - timedelta(seconds=visibility_timeout))
+    )
+    rows = (
+        OutboundMessage.objects.filter(lane=lane, status__in=OPEN_STATUSES)
+        .order_by('id')
+        .values_list('id', 'customer_id')[:outbox_setting('SCAN_SIZE', 500)]
+    )
+    heads = {}
+    for outbound_id, customer_id in rows:
+        heads.setdefault(customer_id, outbound_id)
+    if not heads:
+        return []
+    token = uuid.uuid4().hex
+    # Re-check the claim condition in the UPDATE so concurrent workers never share a row
+    OutboundMessage.objects.filter(claimable, id__in=heads.values()).update(
+        status='processing', locked_at=now, locked_by=token,
+    )
+    return list(
+        OutboundMessage.objects.filter(locked_by=token, status='processing')
+        .select_related('customer').order_by('id')
+    )
+
+
+def send_payload(to_number, payload):
+    kind = payload.get('type')
+    # Agent messages are interactive sends, ahead of broadcasts; a lane only
+    # blocks briefly for a slot, longer waits reschedule the row instead
+    limits = {'max_wait': RATE_LIMIT_MAX_WAIT}
+    if kind == 'text':
+        return send_whatsapp_message(to_number, template_name=None, text=payload['text'], **limits)
+    if kind == 'template':
+        return send_whatsapp_message(to_number, payload['template_name'], **limits)
+    if kind == 'media':
+        options = {
+            'media_type': payload.get('media_type', 'document'),
+            'caption': payload.get('caption'),
+            'filename': payload.get('filename'),
+            **limits,
+        }
+        blob = MediaBlob.objects.filter(id=payload.get('blob_id')).first() if payload.get('blob_id') else None
+        if blob is None:
+            # Media stored before the blob store existed: let Meta fetch the link
+            return send_whatsapp_media(to_number, payload['media_url'], **options)
+        media_id = get_media_id(blob, payload.get('filename'))
+        api_response = send_whatsapp_media(to_number, None, media_id=media_id, **options)
+        if is_media_id_error(api_response):
+            logger.info(f"Media id {media_id} was rejected; uploading {blob.file.name} again")
+            media_id = get_media_id(blob, payload.get('filename'), refresh=True)
+            api_response = send_whatsapp_media(to_number, None, media_id=media_id, **options)
+        return api_response
+    raise ValueError(f"Unknown outbound payload type: {kind!r}")
+
+
+def mark_sent(item, wa_id):
+    now = timezone.now()
+    with serialized_transaction():
+        OutboundMessage.objects.filter(id=item.id, locked_by=item.locked_by).update(
+            status='sent', attempts=item.attempts, last_error='', sent_at=now, locked_at=None, locked_by='',
+        )
+        # Status ticks arrive by webhook; the id is what lets them find this row
+        Message.objects.filter(id=item.message_id).update(whatsapp_message_id=wa_id, updated_at=now)
+    notify_customer(item.customer_id)
+    registry.inc('outbox_sends_total', {'result': 'sent'})
+
+
+def record_failure(item, error, retryable, delay=None):
+    max_attempts = outbox_setting('MAX_ATTEMPTS', 5)
+    now = timezone.now()
+    if retryable and item.attempts < max_attempts:
+        # Exponential backoff: 2, 4, 8 ... seconds, capped by OUTBOUND_BACKOFF_MAX
+        delay = delay or min(2 ** item.attempts, outbox_setting('BACKOFF_MAX', 300))
+        OutboundMessage.objects.filter(id=item.id, locked_by=item.locked_by).update(
+            status='pending', attempts=item.attempts, last_error=error,
+            available_at=now + timedelta(seconds=delay), locked_at=None, locked_by='',
+        )
+        logger.warning(f"Outbound #{item.id} attempt {item.attempts} failed, retrying in {delay:.0f}s: {error}")
+        registry.inc('outbox_sends_total', {'result': 'retry'})
+        return
+    with serialized_transaction():
+        OutboundMessage.objects.filter(id=item.id, locked_by=item.locked_by).update(
+            status='failed', attempts=item.attempts, last_error=error, locked_at=None, locked_by='',
+        )
+        Message.objects.filter(id=item.message_id, status='pending').update(status='failed', updated_at=now)
+        record_status_changes([item.message_id])
+    notify_customer(item.customer_id)
+    registry.inc('outbox_sends_total', {'result': 'failed'})
+    logger.error(f"Outbound #{item.id} to {item.customer.phone_number} failed after {item.attempts} attempt(s): {error}")
+
+
+def process_item(item):
+    """Send one claimed row; returns True when WhatsApp accepted the message"""
+    item.attempts += 1
+    try:
+        api_response = send_payload(item.customer.phone_number, item.payload)
+    except OperationalError as exc:
+        # The database was busy before the send (rate limit, media id)
+        record_failure(item, f"{type(exc).__name__}: {exc}", retryable=True)
+        return False
+    except requests.RequestException as exc:
+        if never_sent(exc):
+            record_failure(item, f"{type(exc).__name__}: {exc}", retryable=True)
+        else:
+            # E.g. a read timeout or a reset connection: the request may have
+            # reached Graph and been delivered, so sending again could
+            # duplicate it. The agent decides.
+            record_failure(item, f"Delivery unknown, not resent ({type(exc).__name__}: {exc})", retryable=False)
+        return False
+    except RateLimited as exc:
+        # Never reached Meta, so it does not use up the retry budget
+        item.attempts -= 1
+        record_failure(item, str(exc), retryable=True, delay=exc.retry_after)
+        return False
+    except MediaUploadError as exc:
+        record_failure(item, str(exc), retryable=exc.retryable)
+        return False
+    except Exception:
+        logger.exception(f"Outbound #{item.id} could not be sent")
+        record_failure(item, traceback.format_exc(), retryable=False)
+        return False
+    wa_id = extract_message_id(api_response)
+    if wa_id:
+        mark_sent(item, wa_id)
+        return True
+    code, message = response_error(api_response)
+    error = f"{code}: {message}" if code else f"Unexpected response: {api_response}"
+    record_failure(item, error, retryable=is_retryable_error(api_response))
+    return False
+
+
+def replay(queryset):
+    """Give failed sends a fresh retry budget and put their messages back to pending"""
+    ids = list(queryset.filter(status='failed').values_list('id', 'message_id', 'customer_id'))
+    if not ids:
+        return 0
+    with transaction.atomic():
+        OutboundMessage.objects.filter(id__in=[row[0] for row in ids]).update(
+            status='pending', attempts=0, available_at=timezone.now(), locked_at=None, locked_by='',
+        )
+        message_ids = [row[1] for row in ids]
+        Message.objects.filter(id__in=message_ids, status='failed').update(status='pending', updated_at=timezone.now())
+        record_status_changes(message_ids)
+    for customer_id in {row[2] for row in ids}:
+        notify_customer(customer_id)
+    return len(ids)
+
+
+def outbox_stats():
+    """Queue depth per status and age of the oldest unsent message"""
+    counts = OutboundMessage.objects.filter(status__in=OPEN_STATUSES + ('failed',)).aggregate(
+        pending=Count('id', filter=Q(status='pending')),
+        processing=Count('id', filter=Q(status='processing')),
+        failed=Count('id', filter=Q(status='failed')),
+        oldest_open=Min('created_at', filter=Q(status__in=OPEN_STATUSES)),
+    )
+    oldest = counts.pop('oldest_open')
+    counts['lag_seconds'] = (timezone.now() - oldest).total_seconds() if oldest else 0.0
+    return counts
+
+
+def run_lane(lane, stop, poll_interval=1.0, once=False):
+    """Send the lane's queue head by head until ``stop`` is set"""
+    try:
+        while not stop.is_set():
+            close_old_connections()
+            try:
+                batch = claim_heads(lane)
+                for item in batch:
+                    process_item(item)
+            except Exception:
+                # E.g. the database locked or gone: keep the lane alive. Claimed
+                # rows are reclaimed once their lock expires.
+                logger.exception(f"Outbound lane {lane} failed; retrying in {poll_interval * 5:.0f}s")
+                connection.close()
+                stop.wait(poll_interval * 5)
+                continue
+            if not batch:
+                if once:
+                    return
+                stop.wait(poll_interval)
+    finally:
+        connection.close()
+
+
+def run_worker(lanes=None, poll_interval=1.0, once=False):
+    """Run one thread per lane (all lanes by default) until interrupted"""
+    set_role('outbox')
+    lanes = list(range(outbox_setting('LANES', 4))) if lanes is None else lanes
+    get_access_token()  # warm the token cache before the lane threads start
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=run_lane, args=(lane, stop, poll_interval, once), name=f'outbox-lane-{lane}', daemon=True)
+        for lane in lanes
+    ]
+    for thread in threads:
+        thread.start()
+    logger.info(f"Outbound worker running lanes {lanes}")
+    try:
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=0.5)
+            publish()
+    except KeyboardInterrupt:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        raise
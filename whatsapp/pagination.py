@@ -0,0 +1,22 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class ApiCursorPagination(CursorPagination):
+    """
+    Keyset pagination: each page continues from the last row of the previous
+    one, so deep pages cost the same as the first and rows inserted while a
+    client pages through never shift or repeat results.
+    """
+    page_size = getattr(settings, 'API_PAGE_SIZE', 100)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 1000)
+
+
+class MessageCursorPagination(ApiCursorPagination):
+    # id breaks ties between messages stored in the same instant
+    ordering = ('timestamp', 'id')
+
+
+class CustomerCursorPagination(ApiCursorPagination):
+    ordering = ('id',)
@@ -0,0 +1,150 @@
+"""
+Send rate limits for the Graph API, shared by every process.
+
+Meta caps each business number's throughput (SEND_RATE_TIERS, by tier)
+and the messages one recipient gets from it (the pair rate: one every six
+seconds, with short bursts). Going over either fails the send with 130429
+or 131056. Every /messages call first takes a token from the number's
+bucket and the pair's bucket.
+
+Buckets are SendRateBucket rows using GCRA: a row stores the time at
+which the bucket is full again, and taking a token is one conditional
+UPDATE. Web workers, outbox lanes and broadcast threads share them
+without any other coordination. Sends have a priority: interactive ones
+(agent replies, API calls) may use the whole burst, bulk ones (broadcasts)
+leave SEND_RATE_INTERACTIVE_RESERVE of it unused and keep waiting while the
+bucket is that low, so an agent reply goes out ahead of a running campaign.
+When Meta reports throttling anyway, ``throttled`` empties the bucket
+concerned for a while.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from .db import serialized_write
+from .metrics import registry
+from .models import SendRateBucket
+
+logger = logging.getLogger("whatsapp.ratelimit")
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+# Graph API error codes for exceeding the number's throughput and the pair rate
+THROUGHPUT_ERROR_CODE = 130429
+PAIR_ERROR_CODE = 131056
+
+PURGE_INTERVAL = 3600  # seconds between deletions of idle pair buckets (per process)
+_last_purge = {'at': 0.0}
+
+
+class RateLimited(Exception):
+    """No send slot within the caller's maximum wait; retry after ``retry_after`` seconds"""
+
+    def __init__(self, key, retry_after):
+        super().__init__(f"Send rate limit {key}: next slot in {retry_after:.1f}s")
+        self.key = key
+        self.retry_after = retry_after
+
+
+def ratelimit_setting(name, default):
+    return getattr(settings, f'SEND_RATE_{name}', default)
+
+
+class Bucket:
+    def __init__(self, key, scope, rate, burst):
+        self.key = key
+        self.scope = scope
+        self.interval = 1.0 / rate
+        self.burst = max(1.0, float(burst))
+
+    def tolerance(self, priority):
+        """How far ahead of now the bucket may be booked for a send of this priority"""
+        burst = self.burst
+        if priority == BULK:
+            burst = max(1.0, burst * (1 - ratelimit_setting('INTERACTIVE_RESERVE', 0.25)))
+        return (burst - 1) * self.interval
+
+
+def number_bucket(phone_number_id):
+    tiers = ratelimit_setting('TIERS', {'standard': 80})
+    rate = tiers[ratelimit_setting('TIER', 'standard')]
+    return Bucket(f'number:{phone_number_id}', 'number', rate, ratelimit_setting('BURST', rate))
+
+
+def pair_bucket(phone_number_id, to_number):
+    return Bucket(
+        f'pair:{phone_number_id}:{to_number}', 'pair',
+        ratelimit_setting('PAIR_PER_SECOND', 1 / 6), ratelimit_setting('PAIR_BURST', 20),
+    )
+
+
+@serialized_write
+def take_token(key, interval, tolerance, now):
+    """Take one token if the bucket has one; returns 0.0 when taken, else the seconds until one is free"""
+    for _ in range(2):
+        taken = SendRateBucket.objects.filter(key=key, tat__lte=now + tolerance).update(
+            tat=Greatest(F('tat'), Value(now)) + interval
+        )
+        if taken:
+            return 0.0
+        tat = SendRateBucket.objects.filter(key=key).values_list('tat', flat=True).first()
+        if tat is not None:
+            return max(tat - tolerance - now, 0.001)
+        # First send for this key: create a full bucket and take from it
+        SendRateBucket.objects.bulk_create([SendRateBucket(key=key, tat=0.0)], ignore_conflicts=True)
+    return 0.0
+
+
+def wait_for_token(bucket, priority, deadline):
+    waited = 0.0
+    while True:
+        wait = take_token(bucket.key, bucket.interval, bucket.tolerance(priority), time.time())
+        if not wait:
+            break
+        if time.monotonic() + wait > deadline:
+            registry.inc('send_rate_limited_total', {'scope': bucket.scope, 'priority': priority})
+            raise RateLimited(bucket.key, wait)
+        time.sleep(wait)
+        waited += wait
+    registry.observe('send_rate_wait_seconds', waited, {'scope': bucket.scope, 'priority': priority})
+
+
+def acquire(phone_number_id, to_number, priority=INTERACTIVE, max_wait=None):
+    """
+    Wait until a message to ``to_number`` fits both the pair and the
+    number's rate. Raises RateLimited instead of waiting longer than
+    ``max_wait`` seconds (default SEND_RATE_MAX_WAIT).
+    """
+    max_wait = ratelimit_setting('MAX_WAIT', 30) if max_wait is None else max_wait
+    deadline = time.monotonic() + max_wait
+    wait_for_token(pair_bucket(phone_number_id, to_number), priority, deadline)
+    wait_for_token(number_bucket(phone_number_id), priority, deadline)
+    if time.monotonic() - _last_purge['at'] > PURGE_INTERVAL:
+        _last_purge['at'] = time.monotonic()
+        purge_idle_buckets()
+
+
+def throttled(phone_number_id, to_number, error_code):
+    """Hold back further sends after Meta rejected one for going over a limit"""
+    if error_code == THROUGHPUT_ERROR_CODE:
+        bucket, pause = number_bucket(phone_number_id), ratelimit_setting('THROTTLE_PAUSE', 2)
+    elif error_code == PAIR_ERROR_CODE:
+        bucket = pair_bucket(phone_number_id, to_number)
+        pause = bucket.interval
+    else:
+        return
+    registry.inc('send_throttled_total', {'scope': bucket.scope})
+    logger.warning(f"Meta throttled sends ({error_code}); holding {bucket.key} for {pause:.0f}s")
+    # Fully booked until ``pause`` from now, whatever the priority
+    hold_until = time.time() + pause + bucket.tolerance(INTERACTIVE)
+    SendRateBucket.objects.filter(key=bucket.key).update(tat=Greatest(F('tat'), Value(hold_until)))
+
+
+def purge_idle_buckets():
+    """Delete buckets that have been full for a while; pair buckets accumulate one row per recipient"""
+    deleted, _ = SendRateBucket.objects.filter(tat__lt=time.time() - PURGE_INTERVAL).delete()
+    return deleted
@@ -0,0 +1,190 @@
+"""
+Full-text search over message content.
+
+The backend is chosen by SEARCH_BACKEND (a dotted path); by default SQLite
+databases use an FTS5 index and anything else falls back to LIKE scans.
+
+The FTS5 table is an external-content index over ``whatsapp_message``,
+kept current by triggers (created in migration 0017 and re-checked after
+every ``migrate``, since SQLite table rebuilds drop triggers), so bulk
+inserts and ``update()`` calls are indexed too. ``rebuild_search_index``
+rebuilds it from scratch.
+
+Only the hot Message table is searched: messages moved to ArchivedMessage
+(see whatsapp.archive) are not found.
+"""
+import logging
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.module_loading import import_string
+
+from .models import Message
+
+logger = logging.getLogger("whatsapp.search")
+
+FTS_TABLE = 'whatsapp_message_fts'
+# Private-use characters mark matches until the snippet is HTML-escaped
+MARK_START, MARK_END = '\ue000', '\ue001'
+SNIPPET_TOKENS = 12
+TERM_RE = re.compile(r'\w+')
+
+FTS_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON whatsapp_message BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON whatsapp_message BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF content ON whatsapp_message BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+
+
+def search_terms(query):
+    return TERM_RE.findall(query or '')
+
+
+def mark_snippet(text):
+    """HTML-escape a snippet and turn the match markers into <mark> tags"""
+    return escape(text).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+class BasicSearchBackend:
+    """Case-insensitive LIKE matching on every term; works on any database but scans"""
+
+    def match_ids(self, query):
+        matches = Message.objects.all()
+        for term in search_terms(query):
+            matches = matches.filter(content__icontains=term)
+        return matches.values('id')
+
+    def search(self, query, customers, limit):
+        terms = search_terms(query)
+        if not terms:
+            return []
+        rows = (
+            Message.objects.filter(id__in=self.match_ids(query), customer__in=customers)
+            .order_by('-timestamp', '-id').values_list('id', 'content')[:limit]
+        )
+        return [(message_id, self.snippet(content, terms)) for message_id, content in rows]
+
+    def snippet(self, content, terms):
+        pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+        first = pattern.search(content)
+        start = max(first.start() - 40, 0) if first else 0
+        text = content[start:start + 120]
+        text = pattern.sub(lambda m: f"{MARK_START}{m.group(0)}{MARK_END}", text)
+        return mark_snippet(('…' if start else '') + text + ('…' if start + 120 < len(content) else ''))
+
+
+class SQLiteFTSSearchBackend:
+    """Ranked (bm25) search with highlighted snippets from the FTS5 index"""
+
+    def fts_query(self, query):
+        # Quote every term so user input can never be FTS5 syntax; the last
+        # one is a prefix so results follow the user's typing
+        terms = search_terms(query)
+        if not terms:
+            return None
+        quoted = [f'"{term}"' for term in terms]
+        quoted[-1] += '*'
+        return ' '.join(quoted)
+
+    def match_ids(self, query):
+        match = self.fts_query(query)
+        if match is None:
+            return Message.objects.none().values('id')
+        return RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match])
+
+    def search(self, query, customers, limit):
+        match = self.fts_query(query)
+        if match is None:
+            return []
+        scope_sql, scope_params = customers.values('id').query.sql_with_params()
+        sql = (
+            f"SELECT m.id, snippet({FTS_TABLE}, 0, %s, %s, '…', {SNIPPET_TOKENS}) "
+            f"FROM {FTS_TABLE} JOIN whatsapp_message m ON m.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH %s AND m.customer_id IN ({scope_sql}) "
+            f"ORDER BY {FTS_TABLE}.rank LIMIT %s"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [MARK_START, MARK_END, match, *scope_params, limit])
+            return [(message_id, mark_snippet(snippet)) for message_id, snippet in cursor.fetchall()]
+
+
+def fts_available():
+    return connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+
+
+@lru_cache(maxsize=1)
+def get_backend():
+    path = getattr(settings, 'SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    return SQLiteFTSSearchBackend() if fts_available() else BasicSearchBackend()
+
+
+def search_messages(query, customers, limit=None):
+    """
+    Messages matching ``query`` among ``customers`` (a Customer queryset,
+    i.e. what the caller may see), best match first. Returns dicts with the
+    message fields the dashboard shows plus ``snippet`` (safe HTML).
+    Archived messages are not searched.
+    """
+    limit = min(int(limit or getattr(settings, 'SEARCH_RESULTS_LIMIT', 20)), 100)
+    hits = get_backend().search(query, customers, limit)
+    if not hits:
+        return []
+    rows = {
+        row['id']: row
+        for row in Message.objects.filter(id__in=[message_id for message_id, _ in hits]).values(
+            'id', 'customer_id', 'customer__name', 'customer__phone_number', 'direction', 'timestamp'
+        )
+    }
+    results = []
+    for message_id, snippet in hits:
+        row = rows.get(message_id)
+        if row is None:
+            continue
+        results.append({
+            'id': message_id,
+            'customer_id': row['customer_id'],
+            'customer_name': row['customer__name'] or row['customer__phone_number'],
+            'direction': row['direction'],
+            'timestamp': row['timestamp'].isoformat(),
+            'snippet': snippet,
+        })
+    return results
+
+
+def ensure_fts_triggers(using=connection):
+    """Recreate missing index triggers (SQLite drops them when Django rebuilds the table)"""
+    if using.vendor != 'sqlite' or FTS_TABLE not in using.introspection.table_names():
+        return False
+    with using.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (%s, %s, %s)",
+            [f'{FTS_TABLE}_ai', f'{FTS_TABLE}_ad', f'{FTS_TABLE}_au'],
+        )
+        if cursor.fetchone()[0] == len(FTS_TRIGGERS):
+            return False
+        for statement in FTS_TRIGGERS:
+            cursor.execute(statement)
+    rebuild_index(using)
+    logger.warning("Search index triggers were missing; recreated them and rebuilt the index")
+    return True
+
+
+def rebuild_index(using=connection):
+    if using.vendor == 'sqlite' and FTS_TABLE in using.introspection.table_names():
+        with using.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        return True
+    return False
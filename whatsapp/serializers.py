@@ -1,7 +1,33 @@
 from rest_framework import serializers
 from .models import Customer, Message, Template
 
-class CustomerSerializer(serializers.ModelSerializer):
+
+def requested_fields(request):
+    """Field names from ``?fields=a,b``, or None when the client wants every field"""
+    if request is None:
+        return None
+    raw = request.query_params.get('fields')
+    if not raw:
+        return None
+    return {name.strip() for name in raw.split(',') if name.strip()}
+
+
+class SparseFieldsMixin:
+    """Lets clients trim each row to the fields they ask for with ``?fields=``"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        wanted = requested_fields(self.context.get('request'))
+        if not wanted:
+            return
+        unknown = wanted - set(self.fields)
+        if unknown:
+            raise serializers.ValidationError({'fields': f"Unknown field(s): {', '.join(sorted(unknown))}"})
+        for name in set(self.fields) - wanted:
+            self.fields.pop(name)
+
+
+class CustomerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Customer
         fields = '__all__'
@@ -21,3 +47,15 @@ class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
         fields = ['id', 'customer', 'customer_id', 'template', 'template_id', 'content', 'media', 'direction', 'status', 'timestamp', 'whatsapp_message_id']
+
+
+class MessageListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Flat row for list responses: related objects as ids only"""
+
+    class Meta:
+        model = Message
+        fields = [
+            'id', 'customer', 'template', 'content', 'media', 'media_type', 'direction', 'status',
+            'timestamp', 'updated_at', 'is_read', 'whatsapp_message_id',
+        ]
+        read_only_fields = fields
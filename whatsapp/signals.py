@@ -0,0 +1,69 @@
+import mimetypes
+import os
+
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_save
+from django.dispatch import receiver
+
+from .conversations import refresh_summary
+from .media_downloader import extension_for
+from .media_store import refresh_ref_counts, store_file
+from .middleware import track_query
+from .models import Message, WhatsAppConfig
+from .search import ensure_fts_triggers, get_backend
+from .whatsapp_api import invalidate_access_token
+
+
+@receiver(post_save, sender=WhatsAppConfig)
+@receiver(post_delete, sender=WhatsAppConfig)
+def access_token_changed(sender, **kwargs):
+    invalidate_access_token()
+
+
+@receiver(pre_save, sender=Message)
+def store_message_media(sender, instance, **kwargs):
+    # New uploads (dashboard, admin, API) go to the content-addressed store
+    # instead of a fresh file under chat_media/
+    media = instance.media
+    if not media or media._committed:
+        return
+    mime_type = instance.media_type or mimetypes.guess_type(media.name)[0] or 'application/octet-stream'
+    ext = os.path.splitext(media.name)[1].lstrip('.').lower() or extension_for(mime_type)
+    blob = store_file(media, mime_type, ext)
+    media.name = blob.file.name
+    media._committed = True
+    instance.media_blob = blob
+
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created, update_fields=None, **kwargs):
+    if instance.media_blob_id and (created or (update_fields and 'media_blob' in update_fields)):
+        refresh_ref_counts([instance.media_blob_id])
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, **kwargs):
+    # Never create here: the customer itself may be going away in this cascade
+    customer_id = instance.customer_id
+    transaction.on_commit(lambda: refresh_summary(customer_id, create=False))
+    if instance.media_blob_id:
+        blob_id = instance.media_blob_id
+        transaction.on_commit(lambda: refresh_ref_counts([blob_id]))
+
+
+@receiver(post_migrate)
+def search_index_migrated(sender, using='default', **kwargs):
+    if sender.name != 'whatsapp':
+        return
+    # Table rebuilds in later migrations drop the FTS triggers; put them back
+    ensure_fts_triggers(connections[using])
+    get_backend.cache_clear()
+
+
+@receiver(connection_created)
+def install_query_tracking(sender, connection, **kwargs):
+    # Request metrics count queries through this wrapper. Fires again when a
+    # persistent connection reconnects, so install it once
+    if track_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(track_query)
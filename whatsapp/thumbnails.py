@@ -0,0 +1,94 @@
+"""
+Thumbnails and placeholders for image attachments.
+
+Generated once when a message with an image is stored (webhook ingest or
+agent upload): a THUMBNAIL_SIZE WebP (JPEG where Pillow lacks WebP) that the
+chat renders instead of the original, and a blurred 16px JPEG data URI
+(under a kilobyte) shown while the thumbnail loads. The original stays one
+click away.
+"""
+import base64
+import io
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageFilter, ImageOps, features
+
+from .media_store import blob_sha256
+
+logger = logging.getLogger("whatsapp.thumbnails")
+
+PLACEHOLDER_SIZE = (16, 16)
+EXIF_ORIENTATION = 0x0112
+
+
+def thumbnail_setting(name, default):
+    return getattr(settings, f'THUMBNAIL_{name}', default)
+
+
+def thumbnail_format():
+    fmt = thumbnail_setting('FORMAT', 'WEBP').upper()
+    if fmt == 'WEBP' and not features.check('webp'):
+        return 'JPEG'
+    return fmt
+
+
+def encode(image, fmt, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **options)
+    return buffer.getvalue()
+
+
+def render_thumbnail(media_name, media_type):
+    """
+    Build the preview fields for a stored attachment.
+
+    Returns a dict of Message field values (thumbnail, placeholder,
+    media_width, media_height), or an empty dict for non-images and files
+    Pillow cannot decode.
+    """
+    if not media_name or not (media_type or '').startswith('image/'):
+        return {}
+    size = thumbnail_setting('SIZE', (320, 320))
+    try:
+        with default_storage.open(media_name, 'rb') as source, Image.open(source) as image:
+            width, height = image.size
+            if image.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8):
+                width, height = height, width
+            # JPEG decoders can scale down while decoding, which skips most of the work
+            image.draft('RGB', (size[0] * 2, size[1] * 2))
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            image.thumbnail(size, Image.LANCZOS)
+            fmt = thumbnail_format()
+            thumb = encode(image, fmt, quality=thumbnail_setting('QUALITY', 70))
+            tiny = image.copy()
+            tiny.thumbnail(PLACEHOLDER_SIZE)
+            tiny = tiny.filter(ImageFilter.GaussianBlur(1))
+            placeholder = encode(tiny, 'JPEG', quality=40)
+    except (OSError, Image.DecompressionBombError) as exc:
+        logger.warning(f"Could not build a thumbnail for {media_name}: {exc}")
+        return {}
+    stem = os.path.splitext(os.path.basename(media_name))[0]
+    thumb_name = f"chat_thumbs/{stem}.{'webp' if fmt == 'WEBP' else 'jpg'}"
+    # A blob's name is its content hash, so an existing thumbnail of that name
+    # shows the same image. Legacy names (chat_media/logo.png and logo.jpg of
+    # two customers) share stems without sharing content: save() picks a free name
+    if not (blob_sha256(media_name) and default_storage.exists(thumb_name)):
+        thumb_name = default_storage.save(thumb_name, ContentFile(thumb))
+    return {
+        'thumbnail': thumb_name,
+        'placeholder': 'data:image/jpeg;base64,' + base64.b64encode(placeholder).decode('ascii'),
+        'media_width': width,
+        'media_height': height,
+    }
+
+
+def apply_thumbnail(message, fields):
+    for name, value in fields.items():
+        if name == 'thumbnail':
+            message.thumbnail.name = value
+        else:
+            setattr(message, name, value)
@@ -1,13 +1,98 @@
 
 
-import requests
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .graph import graph_client
+from .metrics import log_payload
 from .models import WhatsAppConfig
+from .ratelimit import INTERACTIVE, acquire, throttled
 WHATSAPP_PHONE_NUMBER_ID = "929579463571953"
 
+TOKEN_VERSION_KEY = 'whatsapp:access-token-version'
+
+logger = logging.getLogger("whatsapp.api")
+
+
+class AccessTokenProvider:
+    """
+    Per-process cache of the current access token.
+
+    The token is re-read from the database at most every TTL seconds, and
+    that refresh runs in a background thread while the cached token keeps
+    being served. Saving a WhatsAppConfig bumps a version stamp in the shared
+    cache; each process compares stamps every few seconds and reloads
+    immediately when it moved, so a rotated token reaches every worker.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._token = None
+        self._version = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+        self._refreshing = False
+
+    def get(self):
+        now = time.monotonic()
+        check_interval = getattr(settings, 'WHATSAPP_TOKEN_VERSION_CHECK_INTERVAL', 5)
+        if self._token is None or now - self._checked_at >= check_interval:
+            version = cache.get(TOKEN_VERSION_KEY)
+            if self._token is None or version != self._version:
+                self._load(version)
+                return self._token
+            self._checked_at = now
+        if now - self._loaded_at >= getattr(settings, 'WHATSAPP_TOKEN_CACHE_TTL', 300):
+            self._refresh_in_background()
+        return self._token
+
+    def invalidate(self):
+        with self._lock:
+            self._token = None
+
+    def _load(self, version):
+        config = WhatsAppConfig.objects.order_by('-updated_at').values_list('access_token', flat=True).first()
+        with self._lock:
+            self._token = config or ''
+            self._version = version
+            self._loaded_at = self._checked_at = time.monotonic()
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self._load(cache.get(TOKEN_VERSION_KEY))
+            except Exception:
+                logger.exception("Access token refresh failed; keeping the cached token")
+            finally:
+                self._refreshing = False
+                # Thread-local connection; nothing else will ever close it
+                connection.close()
+
+        threading.Thread(target=refresh, name='access-token-refresh', daemon=True).start()
+
+
+access_token_provider = AccessTokenProvider()
+
 
 def get_access_token():
-    config = WhatsAppConfig.objects.order_by('-updated_at').first()
-    return config.access_token if config else ''
+    return access_token_provider.get()
+
+
+def invalidate_access_token():
+    """Drop cached tokens in this process and, once committed, in every other one"""
+    access_token_provider.invalidate()
+    transaction.on_commit(lambda: cache.set(TOKEN_VERSION_KEY, time.time_ns(), timeout=None))
 
 
 def register_phone_number(pin="123456"):
@@ -15,27 +100,24 @@ def register_phone_number(pin="123456"):
     Register the phone number with WhatsApp Cloud API.
     This completes the phone registration process after adding the certificate.
     """
-    url = f"https://graph.facebook.com/v19.0/{WHATSAPP_PHONE_NUMBER_ID}/register"
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
     data = {
         "messaging_product": "whatsapp",
         "pin": pin
     }
-    response = requests.post(url, headers=headers, json=data)
+    response = graph_client.post(f"{WHATSAPP_PHONE_NUMBER_ID}/register", json=data, idempotent=True)
     return response.json()
 
 
-def send_whatsapp_message(to_number, template_name="hello_world", text=None):
-    url = f"https://graph.facebook.com/v19.0/{WHATSAPP_PHONE_NUMBER_ID}/messages"
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+def post_message(data, priority=INTERACTIVE, max_wait=None):
+    """POST a message within the shared send rate limits (whatsapp.ratelimit)"""
+    acquire(WHATSAPP_PHONE_NUMBER_ID, data["to"], priority, max_wait)
+    response = graph_client.post(f"{WHATSAPP_PHONE_NUMBER_ID}/messages", json=data)
+    result = response.json()
+    throttled(WHATSAPP_PHONE_NUMBER_ID, data["to"], response_error(result)[0])
+    return result
+
+
+def send_whatsapp_message(to_number, template_name="hello_world", text=None, priority=INTERACTIVE, max_wait=None):
     if text:
         data = {
             "messaging_product": "whatsapp",
@@ -53,80 +135,80 @@ def send_whatsapp_message(to_number, template_name="hello_world", text=None):
                 "language": { "code": "en_US" }
             }
         }
-    response = requests.post(url, headers=headers, json=data)
-    return response.json()
+    result = post_message(data, priority, max_wait)
+    log_payload(logger, 'graph_send_message', result, error='error' in result, type=data['type'])
+    return result
 
 
 #
 # Add correct send_whatsapp_media function at the end
-def send_whatsapp_media(to_number, media_url, media_type='image', caption=None, filename=None):
+def send_whatsapp_media(to_number, media_url, media_type='image', caption=None, filename=None, media_id=None,
+                        priority=INTERACTIVE, max_wait=None):
     """
-    Send a media message (image/document/video) to WhatsApp using a public media URL.
+    Send a media message (image/document/video) to WhatsApp using a public media URL,
+    or a media id returned by upload_media (then media_url is not used).
     media_type: 'image', 'document', 'video', 'audio'
+    Sends wait for the shared rate limits; ``priority`` and ``max_wait`` as in ratelimit.acquire.
     """
-    import logging
-    logger = logging.getLogger("whatsapp.api")
-    
-    url = f"https://graph.facebook.com/v19.0/{WHATSAPP_PHONE_NUMBER_ID}/messages"
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    
-    if media_type == 'image':
-        media_payload = {"link": media_url}
-        if caption:
-            media_payload["caption"] = caption
-        data = {
-            "messaging_product": "whatsapp",
-            "to": to_number,
-            "type": "image",
-            "image": media_payload
-        }
-    elif media_type == 'document':
-        media_payload = {"link": media_url}
-        if caption:
-            media_payload["caption"] = caption
-        if filename:
-            media_payload["filename"] = filename
-        data = {
-            "messaging_product": "whatsapp",
-            "to": to_number,
-            "type": "document",
-            "document": media_payload
-        }
-    elif media_type == 'video':
-        media_payload = {"link": media_url}
-        if caption:
-            media_payload["caption"] = caption
-        data = {
-            "messaging_product": "whatsapp",
-            "to": to_number,
-            "type": "video",
-            "video": media_payload
-        }
-    elif media_type == 'audio':
-        data = {
-            "messaging_product": "whatsapp",
-            "to": to_number,
-            "type": "audio",
-            "audio": {"link": media_url}
-        }
-    else:
+    if media_type not in ('image', 'document', 'video', 'audio'):
         # Default to document for unknown types
-        media_payload = {"link": media_url}
-        if filename:
-            media_payload["filename"] = filename
-        data = {
-            "messaging_product": "whatsapp",
-            "to": to_number,
-            "type": "document",
-            "document": media_payload
-        }
+        media_type = 'document'
+    media_payload = {"id": media_id} if media_id else {"link": media_url}
+    if caption and media_type != 'audio':
+        media_payload["caption"] = caption
+    if filename and media_type == 'document':
+        media_payload["filename"] = filename
+    data = {
+        "messaging_product": "whatsapp",
+        "to": to_number,
+        "type": media_type,
+        media_type: media_payload
+    }
     
-    logger.info(f"Sending {media_type} to {to_number}: {media_url}")
-    response = requests.post(url, headers=headers, json=data)
+    logger.debug(f"Sending {media_type} to {to_number}: {f'media id {media_id}' if media_id else media_url}")
+    result = post_message(data, priority, max_wait)
+    log_payload(logger, 'graph_send_media', result, error='error' in result, media_type=media_type)
+    return result
+
+
+def upload_media(path, mime_type, filename=None):
+    """Upload a file to the Graph /media endpoint; the response carries the media ``id``"""
+    with open(path, 'rb') as f:
+        response = graph_client.post(
+            f"{WHATSAPP_PHONE_NUMBER_ID}/media",
+            data={"messaging_product": "whatsapp", "type": mime_type},
+            files={"file": (filename or os.path.basename(path), f, mime_type)},
+            timeout=(3.05, 120),
+            idempotent=True,  # a repeated upload only costs an unused media id
+        )
     result = response.json()
-    logger.info(f"WhatsApp API response: {result}")
+    log_payload(logger, 'graph_upload_media', result, error='error' in result, mime_type=mime_type)
     return result
+
+
+# Graph API error codes worth retrying later: throttling (4, 80007, 130429),
+# pair rate limit (131056) and temporary service errors (1, 2, 131000)
+RETRYABLE_ERROR_CODES = frozenset({1, 2, 4, 80007, 130429, 131000, 131056})
+
+
+def extract_message_id(api_response):
+    """Return the WhatsApp message id from a send response, or None"""
+    if not isinstance(api_response, dict):
+        return None
+    api_messages = api_response.get('messages')
+    if api_messages and isinstance(api_messages, list):
+        return api_messages[0].get('id')
+    return api_response.get('id')
+
+
+def response_error(api_response):
+    """Return (code, message) for a Graph API error response, or (None, '') on success"""
+    error = api_response.get('error') if isinstance(api_response, dict) else None
+    if not error:
+        return None, ''
+    return error.get('code'), error.get('message', '')
+
+
+def is_retryable_error(api_response):
+    code, _ = response_error(api_response)
+    return code in RETRYABLE_ERROR_CODES